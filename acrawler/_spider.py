@@ -1,6 +1,7 @@
 '''Base spider class, must overwirte by user
 '''
 
+import os
 import asyncio
 import logging
 
@@ -15,10 +16,51 @@ class LogAdapter(logging.LoggerAdapter):
         return "{} {}".format(self.extra['name'], msg), kwargs
 
 
+_parsers = {}   # spider class -> instance used in parse process
+
+
+def in_process(parser):
+    '''decorator, run the parser in parse process pool. spider is not
+    picklable, so the parser is called on a bare instance there: it only
+    has log attribute, attributes set in __init__ or initialize are
+    missing. requests passed to send_result are sent back to engine
+    '''
+    parser.in_process = True
+    return parser
+
+
+class _Collector:
+    # stands for engine in parse process, keeps results of send_result
+    def __init__(self):
+        self.results = []
+
+    def send_result(self, results):
+        self.results.extend(results)
+
+
+def _parse_in_process(SpiderClass, name, response):
+    spider = _parsers.get(SpiderClass)
+    if spider is None:
+        spider = SpiderClass.__new__(SpiderClass)
+        spider.log = LogAdapter(
+                logger, {'name': 'parser-{}'.format(os.getpid())})
+        _parsers[SpiderClass] = spider
+    spider._engine = collector = _Collector()
+    result = getattr(spider, name)(response)
+    if not result:
+        result = []
+    elif isinstance(result, Request):
+        result = [result]
+    return list(result) + collector.results
+
+
 class BaseSpider:
     start_urls = []
     allowed_hosts = set()
     spider_count = 0
+    # names of parsers run in process pool to keep event loop free, the
+    # same as decorating them with in_process
+    process_parsers = set()
 
     def __init__(self, engine, settings, loop=None):
         self._loop = asyncio.get_event_loop() if not loop else loop
@@ -26,6 +68,10 @@ class BaseSpider:
         self._debug = settings['debug']
         self._engine = engine
         self._tasks = asyncio.Queue()
+        # max number of tasks can be fetched at the same time
+        self.concurrency = max(settings.get('concurrency', 1), 1)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._running = set()
         BaseSpider.spider_count += 1
         self._name = 'spider-{}'.format(self.spider_count)
         self.log = LogAdapter(logger, {'name': self._name})
@@ -56,16 +102,20 @@ class BaseSpider:
             response.request = request
         return response
 
-    async def _parse(self, response):
-        def do_parse(r):
-            if r.request.parser:
-                parser = getattr(self, r.request.parser)
-            else:
-                parser = self.parse
-            return parser(r)
+    def _in_process(self, name):
+        if name in self.process_parsers:
+            return True
+        return getattr(getattr(self, name), 'in_process', False)
 
+    async def _parse(self, response):
         if isinstance(response, Response):
-            result = do_parse(response)
+            name = response.request.parser or 'parse'
+            if self._in_process(name):
+                result = await self._loop.run_in_executor(
+                        self._engine.parse_pool(), _parse_in_process,
+                        type(self), name, response)
+            else:
+                result = getattr(self, name)(response)
             if result:
                 self.send_result(result)
         elif isinstance(response, Request):
@@ -79,44 +129,58 @@ class BaseSpider:
             await self.initialize()
         else:
             self.initialize()
-        # start crawlling
-        while True:
-            task = await self._tasks.get()
-            if isinstance(task, Stop):
-                remains = []
-                # put back remain tasks
-                while not self._tasks.empty():
-                    task = self._tasks.get_nowait()
-                    task.filter_ignore = True
-                    remains.append(task)
-                if remains:
-                    self.send_result(remains)
-                self.log.info('recieved stop message, stop now')
-                break
-            try:
-                response = await self._fetch(task)
-                if not response:
-                    continue
-                await self._parse(response)
-                self.log.info('task <{}> done'.format(task.url))
-            except asyncio.CancelledError:
-                self.log.warn('force stoped')
-                task.filter_ignore = True
-                self.send_result(task)
-                break
-            except Exception as e:
-                task.filter_ignore = True
-                self.send_result(task)
-                self.log.error('task <{}> failed'.format(task.url))
-                if self._debug:
-                    self.log.exception(e)
-                    self.stop_all()
-                continue
-            finally:
-                # to indecate spider was processed
-                self._engine.task_done(self)
+        # start crawlling, keep at most concurrency tasks in flight
+        try:
+            while True:
+                task = await self._tasks.get()
+                if isinstance(task, Stop):
+                    remains = []
+                    # put back remain tasks
+                    while not self._tasks.empty():
+                        task = self._tasks.get_nowait()
+                        task.filter_ignore = True
+                        remains.append(task)
+                    if remains:
+                        self.send_result(remains)
+                        for task in remains:
+                            self._engine.task_returned(task)
+                    self.log.info('recieved stop message, stop now')
+                    if self._running:
+                        await asyncio.wait(self._running)
+                    break
+                await self._semaphore.acquire()
+                running = self._loop.create_task(self._process(task))
+                self._running.add(running)
+                running.add_done_callback(self._running.discard)
+        except asyncio.CancelledError:
+            for running in self._running:
+                running.cancel()
         self.close()
 
+    async def _process(self, task):
+        try:
+            response = await self._fetch(task)
+            if not response:
+                return
+            await self._parse(response)
+            self.log.info('task <{}> done'.format(task.url))
+        except asyncio.CancelledError:
+            self.log.warn('force stoped')
+            task.filter_ignore = True
+            self.send_result(task)
+            raise
+        except Exception as e:
+            task.filter_ignore = True
+            self.send_result(task)
+            self.log.error('task <{}> failed'.format(task.url))
+            if self._debug:
+                self.log.exception(e)
+                self._engine.stop()
+        finally:
+            self._semaphore.release()
+            # to indecate spider was processed
+            self._engine.task_done(self, task)
+
     def send_result(self, results):
         ''' send result to engine accept a Request object or a iterable
         object that contains Request object
@@ -0,0 +1,70 @@
+'''canonicalize url once for all stages
+
+url is parsed one time, canonical form, host, depth and digest are
+computed together and cached in a bounded LRU keyed by raw url
+'''
+
+import functools
+import urllib.parse as uparse
+
+from hashlib import sha1
+
+
+def get_deep(path):
+    p = path.strip('/')
+    return len(p.split('/'))
+
+
+class CanonicalURL:
+    __slots__ = ['raw', 'url', 'scheme', 'host', 'hostname', 'path',
+                 'depth', 'digest']
+
+    def __init__(self, raw, url, scheme, host, hostname, path, depth,
+                 digest):
+        self.raw = raw
+        self.url = url          # canonical form, used to deduplicate
+        self.scheme = scheme
+        self.host = host        # netloc of url
+        self.hostname = hostname    # without port, used to resolve
+        self.path = path
+        self.depth = depth
+        self.digest = digest    # sha1 digest of canonical form
+
+    @property
+    def fingerprint(self):
+        return self.digest.hex()
+
+    def __repr__(self):
+        return 'CanonicalURL<{}>'.format(self.url)
+
+
+def _canonicalize(url):
+    components = uparse.urlparse(url)
+    ql = uparse.parse_qsl(components.query)
+    unique_query = uparse.urlencode(sorted(ql))    # make query unique
+    unique_url = uparse.urlunparse((
+        components.scheme,
+        components.netloc,
+        components.path.rstrip('/'),
+        components.params,
+        unique_query,
+        ''))
+    return CanonicalURL(url, unique_url, components.scheme,
+                        components.netloc, components.hostname,
+                        components.path,
+                        get_deep(components.path),
+                        sha1(unique_url.encode()).digest())
+
+
+_cached = functools.lru_cache(maxsize=100000)(_canonicalize)
+
+
+def set_cache_size(maxsize):
+    global _cached
+    if maxsize != _cached.cache_info().maxsize:
+        _cached = functools.lru_cache(maxsize=maxsize)(_canonicalize)
+
+
+def canonicalize(url):
+    # return: CanonicalURL of url, it is shared, do not modify it
+    return _cached(url)
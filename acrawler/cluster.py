@@ -0,0 +1,208 @@
+'''run several engines in worker processes, every process owns the hosts
+which are mapped to it by a consistent hash ring
+'''
+
+import copy
+import queue
+import signal
+import asyncio
+import bisect
+import logging
+import threading
+import multiprocessing
+
+from hashlib import md5
+from collections import defaultdict
+
+from .engine import Engine
+from .scheduler import get_host
+from .model import Stop
+
+
+logger = logging.getLogger('Engine')
+
+# settings that point to storage, each shard use its own copy
+_shard_keys = ('sqlite_path', 'db_path', 'log_path', 'spill_path',
+               'mysql_tablename', 'mongo_collectionname')
+
+
+class Probe:
+    '''ask shard to report its status, used to detect termination'''
+
+
+def hash_key(key):
+    return int.from_bytes(md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=64):
+        ring = []
+        for node in nodes:
+            for i in range(replicas):
+                ring.append((hash_key('{}-{}'.format(node, i)), node))
+        ring.sort()
+        self._keys = [k for k, _ in ring]
+        self._nodes = [n for _, n in ring]
+
+    def get_node(self, key):
+        index = bisect.bisect(self._keys, hash_key(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+def shard_settings(settings, shard):
+    settings = copy.deepcopy(settings)
+    for name in ('queue', 'filter'):
+        config = settings['scheduler'].get(name, {})
+        for key in _shard_keys:
+            if key in config:
+                config[key] = '{}_{}'.format(config[key], shard)
+    return settings
+
+
+class ShardEngine(Engine):
+    def __init__(self, settings, SpiderClass,
+                 SchedulerClass, QueueClass,
+                 FilterClass, loop=None, resume=True, *,
+                 shard, inboxes, status):
+        self._shard = shard
+        self._inboxes = inboxes
+        self._status = status
+        self._ring = HashRing(range(len(inboxes)))
+        self._sent = 0
+        self._recv = 0
+        super().__init__(settings, SpiderClass,
+                         SchedulerClass, QueueClass,
+                         FilterClass, loop=loop, resume=resume)
+
+    def _initial(self):
+        self._first_start_file = '.engine_{}'.format(self._shard)
+        super()._initial()
+        receiver = threading.Thread(target=self._receive, daemon=True)
+        receiver.start()
+
+    def _owner(self, request):
+        return self._ring.get_node(get_host(request.url))
+
+    def _boost(self):
+        # every shard boosts with the start requests it owns
+        if self._need_boost():
+            requests = self._SpiderClass.start_request()
+            local = [r for r in requests if self._owner(r) == self._shard]
+            super().send_result(local)
+
+    def send_result(self, results):
+        assert hasattr(results, '__iter__')
+        local, remote = [], defaultdict(list)
+        for request in results:
+            owner = self._owner(request)
+            if owner == self._shard:
+                local.append(request)
+            else:
+                remote[owner].append(request)
+        for owner, requests in remote.items():
+            self._inboxes[owner].put(requests)
+            self._sent += len(requests)
+        if local:
+            super().send_result(local)
+
+    def _receive(self):
+        # runs in a thread, pass messages from other shards to event loop
+        inbox = self._inboxes[self._shard]
+        while True:
+            msg = inbox.get()
+            try:
+                self._loop.call_soon_threadsafe(self._on_message, msg)
+            except RuntimeError:    # event loop was closed
+                return
+            if isinstance(msg, Stop):
+                return
+
+    def _on_message(self, msg):
+        if isinstance(msg, Stop):
+            self.stop()
+        elif isinstance(msg, Probe):
+            self._report('probe')
+        else:
+            self._recv += len(msg)
+            super().send_result(msg)
+            self._check_done()
+
+    def _idle(self):
+        return self._unfinished <= 0 and self._scheduler.is_empty()
+
+    def _report(self, kind='status'):
+        self._status.put(
+            (kind, self._shard, self._idle(), self._sent, self._recv))
+
+    def _check_done(self):
+        # other shards may still send requests to us, so only report
+        # to coordinator, it decides when the whole crawl is done
+        if self._idle():
+            self._report()
+
+
+def _run_shard(shard, settings, SpiderClass, SchedulerClass,
+               QueueClass, FilterClass, resume, inboxes, status):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    engine = ShardEngine(shard_settings(settings, shard), SpiderClass,
+                         SchedulerClass, QueueClass, FilterClass,
+                         loop=loop, resume=resume, shard=shard,
+                         inboxes=inboxes, status=status)
+    engine.run()
+
+
+def _quiescent(reports, count):
+    if len(reports) < count:
+        return False
+    if not all(idle for idle, _, _ in reports.values()):
+        return False
+    sent = sum(s for _, s, _ in reports.values())
+    recv = sum(r for _, _, r in reports.values())
+    return sent == recv
+
+
+def _coordinate(processes, inboxes, status):
+    # four counter method: the crawl is done only if a probe wave
+    # reports exactly the same counters as the previous reports
+    count = len(processes)
+    reports, snapshot, probing = {}, None, None
+    while any(p.is_alive() for p in processes):
+        try:
+            kind, shard, *report = status.get(timeout=1)
+        except queue.Empty:
+            continue
+        reports[shard] = tuple(report)
+        if kind == 'probe' and probing is not None:
+            probing[shard] = tuple(report)
+            if len(probing) < count:
+                continue
+            if probing == snapshot:
+                logger.info('all shards had done')
+                for inbox in inboxes:
+                    inbox.put(Stop())
+                return
+            probing = None
+        if probing is None and _quiescent(reports, count):
+            snapshot, probing = dict(reports), {}
+            for inbox in inboxes:
+                inbox.put(Probe())
+
+
+def run(processes, settings, SpiderClass, SchedulerClass,
+        QueueClass, FilterClass, resume=True):
+    inboxes = [multiprocessing.Queue() for _ in range(processes)]
+    status = multiprocessing.Queue()
+    workers = []
+    for shard in range(processes):
+        p = multiprocessing.Process(
+            target=_run_shard, name='engine-{}'.format(shard),
+            args=(shard, settings, SpiderClass, SchedulerClass,
+                  QueueClass, FilterClass, resume, inboxes, status))
+        p.start()
+        workers.append(p)
+    # workers handle SIGINT by themselves
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _coordinate(workers, inboxes, status)
+    for p in workers:
+        p.join()
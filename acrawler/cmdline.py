@@ -4,6 +4,7 @@ import importlib
 
 from .settings import get_settings_from_file, DEFAULT_CONFIG
 from .settings import make_config
+from . import cluster
 
 
 def get_args():
@@ -12,6 +13,15 @@ def get_args():
             '-t', '--threads',
             dest='threads', type=int,
             help='specify the number of spider to work')
+    parser.add_argument(
+            '-n', '--concurrency',
+            dest='concurrency', type=int,
+            help='specify the number of requests each spider fetch at once')
+    parser.add_argument(
+            '-p', '--processes',
+            dest='processes', type=int,
+            help='specify the number of engine processes, hosts are '
+                 'sharded across them')
     parser.add_argument(
             '-f', '--force',
             dest='resume', action='store_false',
@@ -104,6 +114,18 @@ def execute(SpiderClass, *, SchedulerClass=None,
 
     if args.threads and args.threads > 0:
         settings['engine']['threads'] = args.threads
+    if args.concurrency and args.concurrency > 0:
+        settings['spider']['concurrency'] = args.concurrency
+    if args.processes and args.processes > 0:
+        settings['engine']['processes'] = args.processes
+
+    processes = settings['engine'].get('processes', 1)
+    if processes > 1:
+        cluster.run(processes, settings,
+                    SpiderClass, SchedulerClass,
+                    QueueClass, FilterClass,
+                    resume=args.resume)
+        return
 
     engine = EngineClass(settings,
                          SpiderClass, SchedulerClass,
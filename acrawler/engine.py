@@ -4,10 +4,12 @@ import signal
 import pathlib
 import functools
 
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
 
-from .scheduler import QueueEmpty
 from .model import Stop
+from .session import make_session
+from .resolver import CachingResolver
 
 
 logger = logging.getLogger('Engine')
@@ -50,6 +52,11 @@ class Engine:
         self._resume = resume
         self._interrupt = 0
         self._unfinished = 0
+        self._parse_pool = None
+        self._session = None
+        self._resolver = None
+        self._dns_prefetch = self._settings['engine'].get(
+                'dns_prefetch', True)
         self._initial()
 
     def _initial(self):
@@ -89,11 +96,14 @@ class Engine:
         f.touch()
         return True
 
-    def run(self):
-        loop = self._loop
+    def _boost(self):
         if self._need_boost():
             requests = self._SpiderClass.start_request()
             self.send_result(requests)
+
+    def run(self):
+        loop = self._loop
+        self._boost()
         self._stop_coro = loop.create_task(self._wait_stop())
         self._tasks.append(self._stop_coro)
         self._allot_coro = loop.create_task(self._allot())
@@ -103,7 +113,9 @@ class Engine:
                 self, self._settings['spider'], loop=loop
                 )
             self._spiders.append(spider)
-            self.register(spider)
+            # one waiter for each task the spider can run concurrently
+            for _ in range(spider.concurrency):
+                self.register(spider)
             self._tasks.append(loop.create_task(spider.run()))
         # add signal handler
         loop.add_signal_handler(
@@ -117,32 +129,82 @@ class Engine:
             return
         finally:
             self.cancel_all()
+            # make sure tasks sent back by spiders were stored
+            loop.run_until_complete(self._scheduler.join())
             self._scheduler.close()
+            if self._parse_pool:
+                self._parse_pool.shutdown()
+            if self._session is not None:
+                loop.run_until_complete(self._session.close())
+            if self._resolver is not None:
+                logger.info('dns {}'.format(self._resolver.stats))
+                loop.run_until_complete(self._resolver.close())
             loop.close()
 
     def send_result(self, results):
         assert hasattr(results, '__iter__')
-        self._scheduler.add(results)
+        # adding is not finished until filter and queue stored them
+        adding = self._scheduler.add(results)
+        self._unfinished += 1
+        adding.add_done_callback(self._add_done)
+
+    def _add_done(self, adding):
+        self._unfinished -= 1
+        if not adding.cancelled() and adding.exception():
+            logger.error('add tasks failed, {}'.format(adding.exception()))
+        self._check_done()
+
+    def parse_pool(self):
+        # process pool shared by all spiders, created on first use
+        if self._parse_pool is None:
+            workers = self._settings['engine'].get('parse_workers')
+            self._parse_pool = ProcessPoolExecutor(max_workers=workers)
+        return self._parse_pool
+
+    def session(self):
+        # http session shared by all spiders, created on first use
+        if self._session is None:
+            self._resolver = self.make_resolver()
+            self._session = make_session(
+                    self._settings['engine'],
+                    headers=self._settings['spider'].get('headers'),
+                    resolver=self._resolver)
+            if self._dns_prefetch:
+                self._scheduler.resolver = self._resolver
+        return self._session
+
+    def make_resolver(self):
+        # overwrite to use another upstream resolver, return None to use
+        # the default resolver and dns cache of aiohttp
+        return CachingResolver(self._settings['engine'], loop=self._loop)
 
     async def _allot(self):
-        # allot task to spider which is idled
+        # allot task to spider which is idled, scheduler.next wakes up when
+        # new task was putted, so no need to poll
+        self._check_done()
         while True:
             waiter = await self._waiters.get()
-            try:
-                task = await self._scheduler.next(timeout=1)
-            except asyncio.TimeoutError:
-                if self._unfinished <= 0 and self._scheduler.is_empty():
-                    logger.info('all tasks had done')
-                    self.stop()
-                    break   # tasks is done, break from loop
-                self.register(waiter)
-                continue
+            task = await self._scheduler.next()
             waiter.send(task)
             self._unfinished += 1
 
-    def task_done(self, spider):
+    def _check_done(self):
+        # crawl is done when no task is running and nothing remains queued
+        if self._unfinished <= 0 and self._scheduler.is_empty():
+            logger.info('all tasks had done')
+            self.stop()
+
+    def task_done(self, spider, task=None):
         self.register(spider)
+        self.task_returned(task)
+
+    def task_returned(self, task=None):
+        # task is finished without being processed, such as remains of a
+        # stopping spider which were sent back, spider is not registered
+        if task is not None:
+            self._scheduler.ack(task)
         self._unfinished -= 1
+        self._check_done()
 
     async def _wait_stop(self):
         await self._quit_event.wait()
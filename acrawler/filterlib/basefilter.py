@@ -1,73 +1,109 @@
 import logging
-import urllib.parse as uparse
 from hashlib import sha1
 
-
-logger = logging.getLogger('Scheduler.Filter')
+from .. import canonical
+from ..canonical import canonicalize, get_deep
+from .rules import Rules, host_name
 
 
-def get_deep(path):
-    p = path.strip('/')
-    return len(p.split('/'))
+logger = logging.getLogger('Scheduler.Filter')
 
 
 class BaseFilter:
     allowed_hosts = set()
     allowed_schemes = ['http', 'https']
+    # blocking filter is called in an I/O thread by scheduler
+    blocking = False
 
     def __init__(self, settings):
         self.settings = settings
         self.hostonly = self.settings.get('hostonly')
         self.maxdeep = self.settings.get('maxdeep')
+        # port, case and trailing dot do not matter to allowed hosts
+        self._hosts = {host_name(host) for host in self.allowed_hosts}
+        self.rules = Rules(self.settings.get('allow_domains') or (),
+                           self.settings.get('deny_domains') or (),
+                           self.settings.get('allow_patterns') or (),
+                           self.settings.get('deny_patterns') or ())
+        canonical.set_cache_size(
+                self.settings.get('canonical_cache', 100000))
 
     @classmethod
     def set_hosts(cls, hosts):
         cls.allowed_hosts.update(hosts)
 
     def allowed(self, request):
-        components = uparse.urlparse(request.url)
-
-        if not self.scheme_ok(components.scheme):
-            logger.debug('{} is not a valid URL'.format(request.url))
+        return bool(self.allowed_many([request]))
+
+    def allowed_many(self, requests):
+        '''return: requests which are allowed, order is kept. duplicates
+        in the batch are dropped before seen_many is called, so backend
+        is queried once for the whole batch
+        '''
+        candidates, urls = [], {}
+        for request in requests:
+            url = request.canonical
+            if not self.canonical_ok(request.url, url):
+                continue
+            if url.url in urls:
+                logger.debug('duplicate request<{}> recived'
+                             .format(request.url))
+                continue
+            urls[url.url] = url
+            candidates.append(request)
+        if not candidates:
+            return []
+        seen = self.seen_many(list(urls.values()))
+        return [r for r, s in zip(candidates, seen) if not s]
+
+    def canonical_ok(self, url, canonical):
+        if not self.scheme_ok(canonical.scheme):
+            logger.debug('{} is not a valid URL'.format(url))
             return False
-        if self.hostonly and not self.host_ok(components.netloc):
-            logger.debug('{} not in host lists {}'
-                         .format(components.netloc, self.allowed_hosts))
+        if not self.host_ok(canonical.host):
+            logger.debug('{} is not allowed by host rules'
+                         .format(canonical.host))
             return False
         if self.maxdeep and self.maxdeep > 0:
-            deep = get_deep(components.path)
-            if deep > self.maxdeep:
-                logger.debug('path:{} is too deep'.format(components.path))
+            if canonical.depth > self.maxdeep:
+                logger.debug('path:{} is too deep'.format(canonical.path))
                 return False
-        if self.url_seen(request.url):
+        if not self.rules.url_ok(canonical.url):
+            logger.debug('{} is not allowed by url rules'.format(url))
             return False
-
         return True
 
     def scheme_ok(self, scheme):
         return scheme in self.allowed_schemes
 
     def host_ok(self, host):
-        return host in self.allowed_hosts
+        verdict = self.rules.match_host(host)
+        if self.hostonly and verdict is not False:
+            # allowed hosts of spider are matched exactly, allow_domains
+            # match their subdomains, host matches nothing is rejected
+            return verdict is True or host_name(host) in self._hosts
+        return self.rules.verdict_ok(verdict)
 
     def url_seen(self, url):
-        return False
+        return self.seen_many([canonicalize(url)])[0]
+
+    def seen_many(self, urls):
+        # param urls: CanonicalURL of different urls
+        # return: a list tells if each url was seen. base filter keeps
+        # nothing, so no url is seen, backends overwrite it
+        return [False] * len(urls)
 
     def url_fingerprint(self, url):
         durl = url.encode()
         return sha1(durl).hexdigest()
 
     def url_normalization(self, url):
-        components = uparse.urlparse(url)
-        ql = uparse.parse_qsl(components.query)
-        unique_query = uparse.urlencode(sorted(ql))    # make query unique
-        params = (components.scheme,
-                  components.netloc,
-                  components.path.rstrip('/'),
-                  components.params,
-                  unique_query,
-                  '')
-        return uparse.urlunparse(params)
+        return canonicalize(url).url
+
+    def commit(self):
+        # called after a batch of calls and periodically while idle,
+        # make changes durable
+        pass
 
     def close(self):
         pass
@@ -0,0 +1,131 @@
+'''bloom filter on a memory mapped bit array
+
+keys are digests computed already, such as CanonicalURL.digest, all k
+positions of a key come from its first 128 bits by double hashing, they
+are not hashed again. bits are set in the mapped file directly, so OS
+writes dirty pages back over time, checkpoint only flushes them and the
+header.
+'''
+
+import mmap
+import math
+import struct
+import logging
+
+
+logger = logging.getLogger('Scheduler.Filter')
+
+# magic, count of bits, count of hashes, count of added keys, padded
+_head = struct.Struct('<4sQIQ12x')
+MAGIC = b'ABLM'
+# two 64 bits hashes of a digest
+_pair = struct.Struct('<QQ')
+
+
+def optimal(capacity, error_rate):
+    # return: (bits, hashes) for capacity keys at error_rate
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(round(bits / capacity * math.log(2)), 1)
+    return bits, hashes
+
+
+def is_bloom_file(path):
+    # return: False if path is a file of other format, such as pybloom
+    with path.open('rb') as fd:
+        magic = fd.read(len(MAGIC))
+    return not magic or magic == MAGIC
+
+
+def _pairs(digests):
+    # return: (h1, h2) of each digest, the batch is unpacked in one call
+    return _pair.iter_unpack(b''.join(d[:_pair.size] for d in digests))
+
+
+class BloomFilter:
+    def __init__(self, path, capacity=10000000, error_rate=0.001):
+        self._path = path
+        self.capacity = capacity
+        exists = path.is_file() and path.stat().st_size >= _head.size
+        if not exists:
+            bits, hashes = optimal(capacity, error_rate)
+            with path.open('wb') as fd:
+                fd.write(_head.pack(MAGIC, bits, hashes, 0))
+                fd.truncate(_head.size + (bits + 7) // 8)
+        self._fd = path.open('r+b')
+        self._map = mmap.mmap(self._fd.fileno(), 0)
+        magic, self.bits, self.hashes, self.count = \
+            _head.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            self._fd.close()
+            raise ValueError('{} is not a bloom filter file, '
+                             'remove it or start without resume'
+                             .format(path))
+        if exists:
+            # capacity is decided when the file was created
+            self.capacity = round(
+                    self.bits * math.log(2) ** 2 / -math.log(error_rate))
+        self._view = memoryview(self._map)[_head.size:]
+        self._full = False
+
+    def __contains__(self, digest):
+        return self.contains_many([digest])[0]
+
+    def add(self, digest):
+        # return: True if digest was not in filter
+        return self.add_many([digest])[0]
+
+    def contains_many(self, digests):
+        view, bits, steps = self._view, self.bits, range(self.hashes)
+        result = []
+        for h1, h2 in _pairs(digests):
+            # reduced first, so the math stays in small integers
+            h1, h2 = h1 % bits, (h2 | 1) % bits
+            for i in steps:
+                pos = (h1 + i * h2) % bits
+                if not view[pos >> 3] & (1 << (pos & 7)):
+                    result.append(False)
+                    break
+            else:
+                result.append(True)
+        return result
+
+    def add_many(self, digests):
+        # return: a list tells if each digest was not in filter, a digest
+        # seen earlier in the same batch is reported as existing
+        view, bits, steps = self._view, self.bits, range(self.hashes)
+        result = []
+        for h1, h2 in _pairs(digests):
+            h1, h2 = h1 % bits, (h2 | 1) % bits
+            added = False
+            for i in steps:
+                pos = (h1 + i * h2) % bits
+                mask = 1 << (pos & 7)
+                byte = view[pos >> 3]
+                if not byte & mask:
+                    view[pos >> 3] = byte | mask
+                    added = True
+            result.append(added)
+        self.count += sum(result)
+        if self.count > self.capacity and not self._full:
+            self._full = True
+            logger.warning('bloom filter is over capacity {}, false '
+                           'positive rate will increase'
+                           .format(self.capacity))
+        return result
+
+    def __len__(self):
+        return self.count
+
+    def checkpoint(self):
+        _head.pack_into(self._map, 0, MAGIC, self.bits,
+                        self.hashes, self.count)
+        self._map.flush()
+
+    def close(self):
+        if self._map.closed:
+            return
+        self.checkpoint()
+        self._view.release()
+        self._map.close()
+        self._fd.close()
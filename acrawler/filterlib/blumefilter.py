@@ -1,14 +1,17 @@
+import time
 import logging
 import pathlib
 
-from pybloom_live import ScalableBloomFilter
-
 from .basefilter import BaseFilter
+from .bloom import BloomFilter, is_bloom_file
 
 logger = logging.getLogger('Scheduler.Filter')
 
 
 class BlumeFilter(BaseFilter):
+    # bit array is flushed in I/O thread
+    blocking = True
+
     def __init__(self, settings):
         self._blumeclosed = False
         super().__init__(settings)
@@ -16,35 +19,49 @@ class BlumeFilter(BaseFilter):
         self._path = pathlib.Path(path)
         if not self._path.exists():
             self._path.mkdir()
-        blumefile = settings.get('blumedb')
+        blumefile = settings.get('blumedb', 'blume.db')
         self._blumedb = self._path / blumefile
-        if self._blumedb.is_file():
-            with self._blumedb.open('rb') as fp:
-                self._blumefilter = ScalableBloomFilter.fromfile(fp)
-        else:
-            growth = ScalableBloomFilter.SMALL_SET_GROWTH
-            self._blumefilter = ScalableBloomFilter(10240, 0.001, growth)
-
-    def url_seen(self, url):
-        unique_url = self.url_normalization(url)
-        if unique_url in self._blumefilter:
-            logger.debug('duplicate request<{}> recived'.format(url))
-            return True
-        self._blumefilter.add(unique_url)
-        return False
+        if self._blumedb.is_file() and not is_bloom_file(self._blumedb):
+            # file of pybloom in old versions cannot be read any more
+            legacy = self._blumedb.with_name(blumefile + '.legacy')
+            self._blumedb.replace(legacy)
+            logger.warning('{} is in old format, it is moved to {} and '
+                           'a new one is created'
+                           .format(self._blumedb, legacy))
+        # an empty filter is created if file does not exist
+        self._rebuilt = not self._blumedb.is_file()
+        self._blumefilter = BloomFilter(
+                self._blumedb,
+                settings.get('bloom_capacity', 10000000),
+                settings.get('bloom_error_rate', 0.001))
+        self._checkpoint_interval = settings.get('checkpoint_interval', 60)
+        self._last_checkpoint = time.monotonic()
+
+    def seen_many(self, urls):
+        added = self._blumefilter.add_many([url.digest for url in urls])
+        return [not a for a in added]
+
+    def commit(self):
+        self._checkpoint()
+
+    def _checkpoint(self):
+        # dirty pages are written back by OS, flush them on interval
+        now = time.monotonic()
+        if now - self._last_checkpoint >= self._checkpoint_interval:
+            self._blumefilter.checkpoint()
+            self._last_checkpoint = now
 
     @staticmethod
     def clean(settings):
         path = pathlib.Path(settings['db_path'])
-        blumedb = path / settings['blumedb']
+        blumedb = path / settings.get('blumedb', 'blume.db')
         if blumedb.is_file():
             blumedb.unlink()
 
     def close(self):
         self._blumeclosed = True
         super().close()
-        with self._blumedb.open('wb') as fp:
-            self._blumefilter.tofile(fp)
+        self._blumefilter.close()
 
     def __del__(self):
         if not self._blumeclosed:
@@ -11,10 +11,17 @@ _sql_create = ('CREATE TABLE IF NOT EXISTS urls'
                ' fingerprint CHAR(40) NOT NULL UNIQUE)')
 
 _sql_put = 'INSERT INTO urls (fingerprint) VALUES (?)'
+_sql_put_many = 'INSERT OR IGNORE INTO urls (fingerprint) VALUES (?)'
 _sql_query = 'SELECT fingerprint FROM urls WHERE fingerprint=?'
+_sql_query_many = 'SELECT fingerprint FROM urls WHERE fingerprint IN ({})'
+_sql_query_all = 'SELECT fingerprint FROM urls'
+# keep under SQLITE_MAX_VARIABLE_NUMBER of old SQLite
+_max_variables = 900
 
 
 class SQLiteFilter(BaseFilter):
+    blocking = True
+
     def __init__(self, settings):
         super().__init__(settings)
         self._sqliteclosed = False
@@ -24,20 +31,20 @@ class SQLiteFilter(BaseFilter):
             self._path.mkdir()
         sqlite3file = settings.get('sqlitedb')
         self._db = sqlite3.Connection(str(self._path / sqlite3file))
+        # commits are frequent, WAL keeps each of them cheap
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
         cursor = self._db.cursor()
         try:
             cursor.execute(_sql_create)
         finally:
             cursor.close()
 
-    def url_seen(self, url):
-        unique_url = self.url_normalization(url)
-        fingerprint = self.url_fingerprint(unique_url)
-        if self.in_db(fingerprint):
-            logger.debug('duplicate request<{}> recived'.format(url))
-            return True
-        self.db_add(fingerprint)
-        return False
+    def seen_many(self, urls):
+        fingerprints = [url.fingerprint for url in urls]
+        found = self.in_db_many(fingerprints)
+        self.db_add_many([fp for fp in fingerprints if fp not in found])
+        return [fp in found for fp in fingerprints]
 
     def db_add(self, fingerprint):
         cursor = self._db.cursor()
@@ -55,12 +62,52 @@ class SQLiteFilter(BaseFilter):
         finally:
             cursor.close()
 
+    def db_add_many(self, fingerprints):
+        if not fingerprints:
+            return
+        cursor = self._db.cursor()
+        try:
+            cursor.executemany(_sql_put_many, ((fp,) for fp in fingerprints))
+        finally:
+            cursor.close()
+
+    def in_db_many(self, fingerprints):
+        # return: set of fingerprints which are in database
+        found = set()
+        cursor = self._db.cursor()
+        try:
+            for i in range(0, len(fingerprints), _max_variables):
+                chunk = fingerprints[i:i+_max_variables]
+                query = _sql_query_many.format(','.join('?' * len(chunk)))
+                found.update(r[0] for r in cursor.execute(query, chunk))
+        finally:
+            cursor.close()
+        return found
+
+    def db_iter_many(self, size=10000):
+        # yield: lists of at most size fingerprints in database
+        cursor = self._db.cursor()
+        try:
+            cursor.execute(_sql_query_all)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield [r[0] for r in rows]
+        finally:
+            cursor.close()
+
+    def commit(self):
+        self._db.commit()
+
     @staticmethod
     def clean(settings):
         path = pathlib.Path(settings['db_path'])
         sqlitedb = path / settings['sqlitedb']
-        if sqlitedb.is_file():
-            sqlitedb.unlink()
+        for suffix in ('', '-wal', '-shm'):
+            f = sqlitedb.with_name(sqlitedb.name + suffix)
+            if f.is_file():
+                f.unlink()
 
     def close(self):
         self._sqliteclosed = True
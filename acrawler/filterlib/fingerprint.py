@@ -0,0 +1,158 @@
+'''compact set of integer fingerprints
+
+fingerprints are stored in an open addressing hash table (linear probing)
+on a flat buffer, zero marks an empty slot. a table file is a header
+followed by the raw buffer, so it can be mmaped back without parsing.
+'''
+
+import os
+import sys
+import mmap
+import array
+import struct
+
+
+# magic, byteorder, bits, count, capacity, padded to keep table aligned
+_head = struct.Struct('<4scB2xQQ8x')
+MAGIC = b'AFPT'
+
+_MIN_CAPACITY = 1 << 16
+_MAX_LOAD = 0.7
+
+
+def _typecode(bits):
+    for code in 'IL' if bits == 32 else 'LQ':
+        if array.array(code).itemsize * 8 == bits:
+            return code
+    raise ValueError('unsupported fingerprint bits {}'.format(bits))
+
+
+def from_digest(digest, bits=64):
+    # return: the first bits of digest as an integer, never zero
+    return int.from_bytes(digest[:bits // 8], 'big') or 1
+
+
+def unpack(raw, bits=64):
+    # return: array of big endian fingerprints in raw, tail is ignored
+    code = _typecode(bits)
+    fps = array.array(code)
+    fps.frombytes(raw[:len(raw) - len(raw) % fps.itemsize])
+    if sys.byteorder == 'little':
+        fps.byteswap()
+    return fps
+
+
+class FingerprintTable:
+    def __init__(self, bits=64, capacity=_MIN_CAPACITY):
+        self.bits = bits
+        self._code = _typecode(bits)
+        capacity = max(capacity, _MIN_CAPACITY)
+        # capacity is a power of two, so index is a mask of fingerprint
+        self._capacity = 1 << (capacity - 1).bit_length()
+        self._table = array.array(self._code, bytes(
+                self._capacity * array.array(self._code).itemsize))
+        self._count = 0
+        self._map = None
+        self._views = ()
+
+    def _slot(self, fp):
+        # return: index of fp, or of the empty slot where fp should be
+        table, mask = self._table, self._capacity - 1
+        index = fp & mask
+        while True:
+            value = table[index]
+            if value == fp or value == 0:
+                return index
+            index = (index + 1) & mask
+
+    def __contains__(self, fp):
+        return self._table[self._slot(fp or 1)] != 0
+
+    def add(self, fp):
+        # return: True if fp was not in table
+        fp = fp or 1
+        index = self._slot(fp)
+        if self._table[index]:
+            return False
+        self._table[index] = fp
+        self._count += 1
+        if self._count > self._capacity * _MAX_LOAD:
+            self._resize(self._capacity * 2)
+        return True
+
+    def update(self, fps):
+        for fp in fps:
+            self.add(fp)
+
+    def _resize(self, capacity):
+        old = self._table
+        self._capacity = capacity
+        self._table = array.array(self._code, bytes(
+                capacity * array.array(self._code).itemsize))
+        self._count = 0
+        for fp in old:
+            if fp:
+                self._table[self._slot(fp)] = fp
+                self._count += 1
+        self._release(old)
+
+    def __len__(self):
+        return self._count
+
+    def tofile(self, path):
+        # written to a temporary file first, replaced when completed
+        tmp = path.with_name(path.name + '.tmp')
+        byteorder = b'<' if sys.byteorder == 'little' else b'>'
+        with tmp.open('wb') as fp:
+            fp.write(_head.pack(MAGIC, byteorder, self.bits,
+                                self._count, self._capacity))
+            fp.write(self._table)
+            fp.flush()
+            os.fsync(fp.fileno())
+        tmp.replace(path)
+
+    @classmethod
+    def fromfile(cls, path):
+        '''map the table file copy-on-write, pages are loaded by OS on
+        demand and changes are never written back to the file
+        '''
+        with path.open('rb') as fp:
+            view = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, byteorder, bits, count, capacity = _head.unpack_from(view)
+        if magic != MAGIC:
+            view.close()
+            raise ValueError('{} is not a fingerprint table'.format(path))
+        table = cls.__new__(cls)
+        table.bits = bits
+        table._code = _typecode(bits)
+        table._capacity = capacity
+        table._count = count
+        size = capacity * array.array(table._code).itemsize
+        table._map, table._views = None, ()
+        if byteorder == (b'<' if sys.byteorder == 'little' else b'>'):
+            base = memoryview(view)
+            buf = base[_head.size:_head.size+size]
+            table._map = view
+            table._table = buf.cast(table._code)
+            table._views = (table._table, buf, base)
+        else:
+            table._table = array.array(table._code)
+            table._table.frombytes(view[_head.size:_head.size+size])
+            table._table.byteswap()
+            view.close()
+        return table
+
+    def _release(self, table):
+        # mmap can only be closed after all views on it were released
+        if self._map is not None and isinstance(table, memoryview):
+            for view in self._views:
+                view.release()
+            self._views = ()
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        self._release(self._table)
+        self._table = array.array(self._code)
+        self._capacity = 0
+        self._count = 0
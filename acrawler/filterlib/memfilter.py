@@ -1,12 +1,22 @@
+import time
 import logging
 import pathlib
 
 from .basefilter import BaseFilter
+from .fingerprint import FingerprintTable, from_digest, unpack
 
 logger = logging.getLogger("Scheduler.Filter")
 
 
 class MemFilter(BaseFilter):
+    '''keep fingerprints in a compact hash table, new fingerprints are
+    appended to a binary journal. the whole table is saved as a snapshot
+    periodically and on close, then the journal starts over, so resume
+    only maps the snapshot and replays a short journal
+    '''
+    # snapshot is written in I/O thread
+    blocking = True
+
     def __init__(self, settings):
         super().__init__(settings)
         self._closed = False
@@ -14,42 +24,98 @@ class MemFilter(BaseFilter):
         self._path = pathlib.Path(path)
         if not self._path.exists():
             self._path.mkdir()
+        # 64 bits fingerprints are enough for hundreds of millions urls
+        self._bits = settings.get('fingerprint_bits', 64)
+        self._width = self._bits // 8
 
-        self.fingerprints = set()
-        self._file = self._path / 'filedb'
-        self._fd = self._file.open('a+')
-
+        self._table_file = self._path / 'fingerprints'
+        self._file = self._path / 'fingerprints.journal'
+        self._snapshot_count = settings.get('snapshot_count', 1000000)
+        self._snapshot_interval = settings.get('snapshot_interval', 600)
+        self._journaled = 0     # count of fingerprints since snapshot
+        self._last_snapshot = time.monotonic()
+        self.fingerprints = None
+        self._fd = None
+        self._fd = self._file.open('ab')
         self._initialize()
 
     def _initialize(self):
-        self._fd.seek(0)
-        fingerprint = self._fd.readline()
-        while fingerprint:
-            self.fingerprints.add(fingerprint.strip())
-            fingerprint = self._fd.readline()
-
-    def url_seen(self, url):
-        unique_url = self.url_normalization(url)
-        fingerprint = self.url_fingerprint(unique_url)
-        if fingerprint in self.fingerprints:
-            logger.debug('duplicate request<{}> recived'.format(url))
-            return True
-
-        self.fingerprints.add(fingerprint)
-        self._fd.write(fingerprint + '\n')
-        return False
+        if self._table_file.is_file():
+            table = FingerprintTable.fromfile(self._table_file)
+            if table.bits != self._bits:
+                table.close()
+                raise ValueError('fingerprints were saved in {} bits'
+                                 .format(table.bits))
+            self.fingerprints = table
+        else:
+            self.fingerprints = FingerprintTable(self._bits)
+        # half written fingerprint at the end is ignored
+        journal = unpack(self._file.read_bytes(), self._bits)
+        if journal:
+            start = time.monotonic()
+            self.fingerprints.update(journal)
+            logger.info('replayed {} fingerprints in {:.2f}s'
+                        .format(len(journal), time.monotonic() - start))
+            self._journaled = len(journal)
+        # journal of old versions keeps hex digests line by line
+        legacy = self._path / 'filedb'
+        if legacy.is_file():
+            with legacy.open() as fd:
+                for line in fd:
+                    if line.strip():
+                        self.fingerprints.add(
+                                int(line.strip()[:self._width * 2], 16))
+            self._save()
+            legacy.unlink()
+
+    def _save(self):
+        # save the whole table, then the journal is useless. if crashed
+        # before truncating, replaying the journal again is harmless
+        self._fd.flush()
+        self.fingerprints.tofile(self._table_file)
+        self._fd.truncate(0)
+        self._journaled = 0
+        self._last_snapshot = time.monotonic()
+
+    def seen_many(self, urls):
+        seen, added = [], []
+        add, bits = self.fingerprints.add, self._bits
+        for url in urls:
+            fp = from_digest(url.digest, bits)
+            if add(fp):
+                added.append(fp.to_bytes(self._width, 'big'))
+                seen.append(False)
+            else:
+                logger.debug('duplicate request<{}> recived'.format(url.raw))
+                seen.append(True)
+        if added:
+            self._fd.write(b''.join(added))
+            self._journaled += len(added)
+        return seen
+
+    def commit(self):
+        if self._journaled and (
+                self._journaled >= self._snapshot_count or
+                time.monotonic() - self._last_snapshot
+                >= self._snapshot_interval):
+            self._save()
+        else:
+            self._fd.flush()
 
     @staticmethod
     def clean(settings):
         path = pathlib.Path(settings.get('db_path', './'))
-        fd = path / 'filedb'
-        if fd.is_file():
-            fd.unlink()
+        for name in ('filedb', 'fingerprints', 'fingerprints.journal'):
+            fd = path / name
+            if fd.is_file():
+                fd.unlink()
 
     def close(self):
         if not self._closed:
             self._closed = True
-            self.fingerprints.clear()
+            if self.fingerprints is not None:   # None if failed to init
+                self._save()
+                self.fingerprints.close()
             self._fd.close()
 
     def __del__(self):
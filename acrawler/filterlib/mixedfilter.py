@@ -1,5 +1,8 @@
+import time
 import logging
 
+from collections import OrderedDict
+
 from .blumefilter import BlumeFilter
 from .dbfilter import SQLiteFilter
 
@@ -7,23 +10,84 @@ logger = logging.getLogger('Scheduler.Filter')
 
 
 class MixedFilter(BlumeFilter, SQLiteFilter):
+    '''bloom filter answers new urls without disk I/O, their fingerprints
+    are buffered and written to database in bulk. only urls the bloom
+    filter may contain are confirmed in database, behind a read cache
+    '''
+    blocking = True
+
     def __init__(self, settings):
         super().__init__(settings)
         self._mixedclosed = False
+        self._buffer = set()    # fingerprints not written to database
+        self._buffer_size = settings.get('write_buffer', 10000)
+        self._flush_interval = settings.get('flush_interval', 5)
+        self._last_flush = time.monotonic()
+        self._cache = OrderedDict()     # fingerprints known in database
+        self._cache_size = settings.get('read_cache', 100000)
+        if self._rebuilt:
+            self._rebuild()
+
+    def _rebuild(self):
+        # bloom filter is new, fill it with fingerprints in database, or
+        # urls in database are never confirmed
+        for fingerprints in self.db_iter_many():
+            self._blumefilter.add_many(
+                    [bytes.fromhex(fp) for fp in fingerprints])
+        if self._blumefilter.count:
+            logger.info('bloom filter is rebuilt from {} fingerprints'
+                        .format(self._blumefilter.count))
+
+    def _cache_add(self, fingerprints):
+        cache = self._cache
+        for fp in fingerprints:
+            cache[fp] = None
+            cache.move_to_end(fp)
+        while len(cache) > self._cache_size:
+            cache.popitem(last=False)
 
-    def url_seen(self, url):
-        unique_url = self.url_normalization(url)
-        fingerprint = self.url_fingerprint(unique_url)
-        if unique_url in self._blumefilter:
-            if self.in_db(fingerprint):
-                logger.debug('duplicate request<{}> recived'.format(url))
-                return True
-            self.db_add(fingerprint)
-            return False
-        self._blumefilter.add(unique_url)
-        self.db_add(fingerprint)
+    def _known(self, fp):
+        if fp in self._buffer:
+            return True
+        if fp in self._cache:
+            self._cache.move_to_end(fp)
+            return True
         return False
 
+    def seen_many(self, urls):
+        maybe = self._blumefilter.contains_many(
+                [url.digest for url in urls])
+        fingerprints = [url.fingerprint for url in urls]
+        seen = [m and self._known(fp) for fp, m in zip(fingerprints, maybe)]
+        # bloom positive urls which are not known must be confirmed
+        query = [fp for fp, m, s in zip(fingerprints, maybe, seen)
+                 if m and not s]
+        if query:
+            found = self.in_db_many(query)
+            self._cache_add(found)
+            seen = [s or fp in found for fp, s in zip(fingerprints, seen)]
+        new = [i for i, s in enumerate(seen) if not s]
+        self._blumefilter.add_many([urls[i].digest for i in new])
+        self._buffer.update(fingerprints[i] for i in new)
+        if len(self._buffer) >= self._buffer_size:
+            self._flush()
+        return seen
+
+    def _flush(self):
+        # write buffered fingerprints in one transaction
+        if self._buffer:
+            self.db_add_many(list(self._buffer))
+            self._db.commit()
+            self._cache_add(self._buffer)
+            self._buffer.clear()
+        self._last_flush = time.monotonic()
+
+    def commit(self):
+        # database is committed only by _flush, not on every batch
+        if time.monotonic() - self._last_flush >= self._flush_interval:
+            self._flush()
+        self._checkpoint()
+
     @staticmethod
     def clean(settings):
         BlumeFilter.clean(settings)
@@ -31,6 +95,7 @@ class MixedFilter(BlumeFilter, SQLiteFilter):
 
     def close(self):
         self._mixedclosed = True
+        self._flush()
         super().close()
 
     def __del__(self):
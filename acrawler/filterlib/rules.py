@@ -0,0 +1,86 @@
+'''allow and deny rules of hosts and urls
+
+domains are matched by suffix in a trie of reversed labels, the most
+specific rule wins, so a check costs one step per label of host. url
+patterns of each kind are merged into one compiled alternation.
+'''
+
+import re
+
+
+ALLOW = True
+DENY = False
+
+
+def host_name(host):
+    # return: lower case host name, port and trailing dot are removed
+    host = host.rpartition('@')[2].lower()
+    if host.startswith('['):    # ipv6 address
+        return host[1:host.find(']')]
+    return host.partition(':')[0].rstrip('.')
+
+
+class DomainTrie:
+    def __init__(self):
+        self._root = {}
+
+    def add(self, domain, verdict):
+        node = self._root
+        for label in reversed(host_name(domain).lstrip('.').split('.')):
+            node = node.setdefault(label, {})
+        node[None] = verdict
+
+    def match(self, host):
+        # return: verdict of the longest matched domain, None if no match
+        node, verdict = self._root, None
+        for label in reversed(host_name(host).split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            verdict = node.get(None, verdict)
+        return verdict
+
+    def __bool__(self):
+        return bool(self._root)
+
+
+def compile_patterns(patterns):
+    # return: one regex matches any of patterns, None if no pattern
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{})'.format(p) for p in patterns))
+
+
+class Rules:
+    def __init__(self, allow_domains=(), deny_domains=(),
+                 allow_patterns=(), deny_patterns=()):
+        self._domains = DomainTrie()
+        for domain in allow_domains:
+            self._domains.add(domain, ALLOW)
+        for domain in deny_domains:
+            self._domains.add(domain, DENY)
+        # without allow rule, host which matches nothing is allowed
+        self._restricted = bool(allow_domains)
+        self._allow = compile_patterns(allow_patterns)
+        self._deny = compile_patterns(deny_patterns)
+
+    def match_host(self, host):
+        # return: ALLOW or DENY of the most specific domain rule, None if
+        # host matches no rule
+        return self._domains.match(host)
+
+    def host_ok(self, host):
+        return self.verdict_ok(self._domains.match(host))
+
+    def verdict_ok(self, verdict):
+        # return: if host with the verdict of match_host is allowed
+        if verdict is None:
+            return not self._restricted
+        return verdict
+
+    def url_ok(self, url):
+        if self._deny is not None and self._deny.search(url):
+            return False
+        if self._allow is not None and not self._allow.search(url):
+            return False
+        return True
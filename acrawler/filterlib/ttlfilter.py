@@ -0,0 +1,134 @@
+import re
+import time
+import logging
+import pathlib
+
+from .basefilter import BaseFilter
+from .fingerprint import FingerprintTable, from_digest
+
+logger = logging.getLogger('Scheduler.Filter')
+
+_bucket_pattern = re.compile(r'ttl_(?P<start>\d+)\.fpt$')
+
+
+class TTLFilter(BaseFilter):
+    '''a url is seen only within its ttl, then it can be crawled again.
+    fingerprints are kept in buckets of ttl_bucket seconds, a bucket is
+    dropped as a whole when it is older than the longest ttl. a url may
+    wait at most one more bucket before it can be crawled again
+    '''
+    blocking = True
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self._closed = False
+        self._path = pathlib.Path(settings.get('db_path', './'))
+        if not self._path.exists():
+            self._path.mkdir()
+        self._bits = settings.get('fingerprint_bits', 64)
+        self._ttl = settings.get('ttl', 86400)
+        # list of [pattern, ttl], the first matched pattern is used
+        self._rules = [(re.compile(pattern), ttl) for pattern, ttl
+                       in settings.get('ttl_rules') or ()]
+        self._span = settings.get('ttl_bucket', 3600)
+        self._retention = max([self._ttl] + [t for _, t in self._rules])
+        self._save_interval = settings.get('ttl_save_interval', 600)
+        self._last_save = time.monotonic()
+        self._buckets = []      # (start, FingerprintTable), newest first
+        self._load()
+
+    def _bucket_file(self, start):
+        return self._path / 'ttl_{}.fpt'.format(start)
+
+    def _load(self):
+        for child in self._path.iterdir():
+            m = _bucket_pattern.match(child.name)
+            if m:
+                table = FingerprintTable.fromfile(child)
+                self._buckets.append((int(m.group('start')), table))
+                if table.bits != self._bits:
+                    bits = table.bits
+                    self._close_buckets()
+                    raise ValueError('fingerprints in {} were saved in {} '
+                                     'bits'.format(child, bits))
+        self._buckets.sort(key=lambda b: b[0], reverse=True)
+        self._rotate(time.time())
+
+    def _rotate(self, now):
+        # start a new bucket when current one is full, drop expired ones
+        if self._buckets and now < self._buckets[0][0] + self._span:
+            return
+        if self._buckets:
+            self._save()
+        start = int(now // self._span * self._span)
+        self._buckets.insert(0, (start, FingerprintTable(self._bits)))
+        while self._buckets[-1][0] + self._span < now - self._retention:
+            start, table = self._buckets.pop()
+            table.close()
+            if self._bucket_file(start).is_file():
+                self._bucket_file(start).unlink()
+            logger.info('fingerprints bucket {} expired'.format(start))
+
+    def _ttl_of(self, url):
+        for regex, ttl in self._rules:
+            if regex.search(url):
+                return ttl
+        return self._ttl
+
+    def seen_many(self, urls):
+        now = time.time()
+        self._rotate(now)
+        current = self._buckets[0][1]
+        seen = []
+        for url in urls:
+            fp = from_digest(url.digest, self._bits)
+            since = now - self._ttl_of(url.url)
+            hit = False
+            for start, table in self._buckets:
+                if start + self._span <= since:
+                    break       # older buckets are all out of ttl
+                if fp in table:
+                    hit = True
+                    break
+            if hit:
+                logger.debug('duplicate request<{}> recived'.format(url.raw))
+            else:
+                current.add(fp)
+            seen.append(hit)
+        return seen
+
+    def _save(self):
+        start, table = self._buckets[0]
+        table.tofile(self._bucket_file(start))
+        self._last_save = time.monotonic()
+
+    def commit(self):
+        # fingerprints added since last save are lost on crash, those
+        # urls are crawled again
+        if time.monotonic() - self._last_save >= self._save_interval:
+            self._save()
+
+    @staticmethod
+    def clean(settings):
+        path = pathlib.Path(settings.get('db_path', './'))
+        if not path.is_dir():
+            return
+        for f in path.glob('ttl_*.fpt'):
+            f.unlink()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            if self._buckets:
+                self._save()
+            self._close_buckets()
+
+    def _close_buckets(self):
+        for _, table in self._buckets:
+            table.close()
+        self._buckets.clear()
+
+    def __del__(self):
+        if not self._closed:
+            logger.warn('Filter not closed')
+            self.close()
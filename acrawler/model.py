@@ -3,6 +3,10 @@ import time
 import datetime
 import logging
 
+from multidict import CIMultiDict
+
+from .utils import decoder, detect_charset
+from .canonical import canonicalize
 
 logger = logging.getLogger('spider')
 
@@ -15,10 +19,11 @@ class Stop:
 class Request:
     __slots__ = ['url', 'priority', 'fetcher_func', 'parser_func', 'created',
                  'redirect', 'retryed', 'last_activated', 'extra',
-                 'filter_ignore']
+                 'filter_ignore', 'lease', 'options', '_canonical']
 
     def __init__(self, url, *, priority=3, fetcher=None, parser=None,
-                 filter_ignore=False):
+                 filter_ignore=False, max_size=None, content_types=None,
+                 stream=None):
         self.url = url
 
         assert isinstance(priority, int), 'priority is not an integer'
@@ -29,6 +34,8 @@ class Request:
         self.last_activated = None
         self.retryed = 0
         self.filter_ignore = filter_ignore
+        self.lease = None   # set by queue which supports lease
+        self._canonical = None
 
         if fetcher and not callable(fetcher):
             raise ValueError('fetcher_func is not callable')
@@ -39,6 +46,28 @@ class Request:
         self.parser_func = parser.__name__ if parser else None
         self.extra = None
 
+        # fetch options, overwrite the settings of spider
+        self.options = None
+        if max_size is not None:
+            self.set_option('max_body_size', max_size)
+        if content_types is not None:
+            self.set_option('content_types', list(content_types))
+        if stream is not None:
+            if not callable(stream):
+                raise ValueError('{} is not callable'.format(stream))
+            # body is passed to stream chunk by chunk, never buffered
+            self.set_option('stream', stream.__name__)
+
+    def set_option(self, name, value):
+        if self.options is None:
+            self.options = {}
+        self.options[name] = value
+
+    def get_option(self, name, default=None):
+        if not self.options:
+            return default
+        return self.options.get(name, default)
+
     @property
     def extra_data(self):
         return self.extra
@@ -67,30 +96,125 @@ class Request:
             raise ValueError('{} is not callable'.format(value))
         self.fetcher_func = value.__name__
 
+    @property
+    def canonical(self):
+        # CanonicalURL of url, computed on first use
+        canonical = self._canonical
+        if canonical is None or canonical.raw != self.url:
+            canonical = self._canonical = canonicalize(self.url)
+        return canonical
+
+    def __getstate__(self):
+        # canonical url is not stored, it is cheap to compute again
+        state = {k: getattr(self, k) for k in self.__slots__
+                 if k != '_canonical' and hasattr(self, k)}
+        return None, state
+
+    def __setstate__(self, state):
+        # requests stored by older versions lack the newer slots
+        self.lease = self.options = self._canonical = None
+        if isinstance(state, tuple):    # (None, slots) of pickle
+            state = state[1]
+        for name, value in (state or {}).items():
+            setattr(self, name, value)
+
     def __str__(self):
         return 'Request<{}, priority={}>'.format(self.url, self.priority)
 
 
 class Response:
-    def __init__(self, raw, request=None, status=None, headers=None):
+    '''body is kept in bytes, it is decoded on first access of text.
+    param encoding: charset declared by header
+    '''
+
+    def __init__(self, raw, request=None, status=None, headers=None,
+                 encoding=None):
         self._raw = raw
         self._status = status
         self._headers = headers
+        self._encoding = encoding
+        self._text = raw if isinstance(raw, str) else None
         self._json = None
+        self._selector = None
         self.date = datetime.datetime.now()
         self.request = request
 
+    def __getstate__(self):
+        # make sure response can be sent to parse process
+        state = self.__dict__.copy()
+        if state['_headers'] is not None:
+            # repeated headers such as Set-Cookie are kept
+            state['_headers'] = CIMultiDict(state['_headers'])
+        if not isinstance(state['_raw'], str):
+            state['_text'] = None   # decode it in parse process
+        state['_selector'] = None   # tree cannot be pickled
+        return state
+
     @property
     def url(self):
         return self.request.url
 
+    @property
+    def encoding(self):
+        # charset used to decode body, None if nothing is declared
+        if isinstance(self._raw, str):
+            return None
+        return detect_charset(self._raw, self._encoding)
+
     @property
     def text(self):
-        return self._raw
+        if self._text is None:
+            self._text = decoder(self._raw, self._encoding)
+        return self._text
 
     @property
     def raw(self):
+        # body in bytes, use it if the page need not to be decoded
         return self._raw
 
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def headers(self):
+        return self._headers
+
+    @property
+    def selector(self):
+        # page is parsed on first query, the tree is shared by all queries
+        if self._selector is None:
+            from .selector import Selector
+            self._selector = Selector.from_response(self)
+        return self._selector
+
+    def xpath(self, query, **variables):
+        return self.selector.xpath(query, **variables)
+
+    def css(self, query):
+        return self.selector.css(query)
+
+    def re(self, regex):
+        # search text directly, page is not parsed.
+        # bytes pattern searches raw body, page is not even decoded
+        from .selector import extract_re
+        if isinstance(regex, bytes) and isinstance(self._raw, bytes):
+            return extract_re(regex, self._raw)
+        return extract_re(regex, self.text)
+
+    def links(self, query='//a/@href'):
+        # return: absolute urls in page, relative ones are resolved.
+        # query runs on the tree of selector, page is parsed as a whole
+        from .selector import extract_links
+        return extract_links(self.selector.root, self.url, query)
+
+    def follow_links(self, query='//a/@href', **kwargs):
+        '''yield Request of every link in page, links are extracted at
+        once by links(), only Requests are made lazily
+        param kwargs: arguments of Request, such as priority and parser
+        '''
+        for url in self.links(query):
+            yield Request(url, **kwargs)
+
     def __str__(self):
         return 'Response<{}>'.format(self.url)
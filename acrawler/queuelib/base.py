@@ -6,6 +6,9 @@ from collections import deque
 
 
 class BaseQueue:
+    # blocking backend is called in an I/O thread by scheduler
+    blocking = True
+
     def __init__(self, loop=None):
         self._loop = asyncio.get_event_loop() if not loop else loop
         self._getters = deque()
@@ -64,6 +67,31 @@ class BaseQueue:
         # return: count of items in this queue
         raise NotImplementedError
 
+    def commit(self):
+        # called after a batch of calls and periodically while idle,
+        # make changes durable
+        pass
+
+    def _pending(self):
+        # return: concurrent.futures.Future the caller should wait for
+        # when _get found nothing, for queue whose _get never blocks on
+        # its own I/O, None if nothing is pending
+        return None
+
+    def _ack(self, leases):
+        # param leases: lease of items which were done, only queue that
+        # supports lease sets item.lease in _get and keeps it until acked
+        pass
+
+    def _renew(self, leases):
+        # param leases: lease of items which are still wanted, their lease
+        # timeout restarts from now
+        pass
+
+    def _expire(self):
+        # return: leases of items which are timeout and can be got again
+        return []
+
     def close(self):
         raise NotImplementedError
 
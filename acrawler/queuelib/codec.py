@@ -0,0 +1,179 @@
+'''encode Request to bytes before it is stored in queue
+
+binary layout of a Request (version 1), integers are big endian:
+    magic(1) version(1) flags(1) priority(i) redirect(I) retryed(I)
+    created(d) last_activated(d) url(I+bytes) fetcher(H+bytes)
+    parser(H+bytes) extra(I+pickled bytes) [options(I+pickled bytes)]
+a batch is: magic(1) version(1) compressed(1) count(I) then
+(length(I) + record) for every item, zlib compressed if flag is set
+'''
+
+import zlib
+import pickle
+import struct
+
+from ..model import Request
+
+
+MAGIC = b'R'
+BATCH_MAGIC = b'B'
+VERSION = 1
+
+_head = struct.Struct('>cBBiIIdd')
+_batch_head = struct.Struct('>cBBI')
+_u32 = struct.Struct('>I')
+_u16 = struct.Struct('>H')
+
+_FILTER_IGNORE = 1
+_LAST_ACTIVATED = 2
+_EXTRA = 4
+_FETCHER = 8
+_PARSER = 16
+_OPTIONS = 32
+
+
+class PickleCodec:
+    name = 'pickle'
+
+    def dumps(self, item):
+        return pickle.dumps(item)
+
+    def loads(self, raw):
+        # every codec can read records of the others
+        return _loads(raw)
+
+    def dumps_batch(self, items, compress=False):
+        return _dumps_batch(self, items, compress)
+
+    def loads_batch(self, raw):
+        return _loads_batch(self, raw)
+
+
+class BinaryCodec(PickleCodec):
+    name = 'binary'
+
+    def dumps(self, item):
+        if type(item) is not Request:
+            return pickle.dumps(item)
+        flags = 0
+        if item.filter_ignore:
+            flags |= _FILTER_IGNORE
+        if item.last_activated is not None:
+            flags |= _LAST_ACTIVATED
+        extra = b''
+        if item.extra is not None:
+            flags |= _EXTRA
+            extra = pickle.dumps(item.extra)
+        fetcher = (item.fetcher_func or '').encode()
+        if item.fetcher_func:
+            flags |= _FETCHER
+        parser = (item.parser_func or '').encode()
+        if item.parser_func:
+            flags |= _PARSER
+        options = b''
+        if getattr(item, 'options', None):
+            flags |= _OPTIONS
+            options = pickle.dumps(item.options)
+            options = _u32.pack(len(options)) + options
+        url = item.url.encode()
+        return b''.join((
+            _head.pack(MAGIC, VERSION, flags, item.priority,
+                       item.redirect, item.retryed, item.created,
+                       item.last_activated or 0.0),
+            _u32.pack(len(url)), url,
+            _u16.pack(len(fetcher)), fetcher,
+            _u16.pack(len(parser)), parser,
+            _u32.pack(len(extra)), extra, options))
+
+
+def _loads(raw):
+    raw = bytes(raw)
+    if raw[:1] != MAGIC:    # stored by pickle codec
+        return pickle.loads(raw)
+    (_, version, flags, priority, redirect, retryed,
+     created, last_activated) = _head.unpack_from(raw)
+    if version != VERSION:
+        raise ValueError('unknown codec version {}'.format(version))
+    offset = _head.size
+    url, offset = _read(raw, offset, _u32)
+    fetcher, offset = _read(raw, offset, _u16)
+    parser, offset = _read(raw, offset, _u16)
+    extra, offset = _read(raw, offset, _u32)
+    options = None
+    if flags & _OPTIONS:
+        options, offset = _read(raw, offset, _u32)
+        options = pickle.loads(options)
+
+    item = Request.__new__(Request)
+    item.url = url.decode()
+    item.priority = priority
+    item.redirect = redirect
+    item.retryed = retryed
+    item.created = created
+    item.last_activated = (
+            last_activated if flags & _LAST_ACTIVATED else None)
+    item.filter_ignore = bool(flags & _FILTER_IGNORE)
+    item.fetcher_func = fetcher.decode() if flags & _FETCHER else None
+    item.parser_func = parser.decode() if flags & _PARSER else None
+    item.extra = pickle.loads(extra) if flags & _EXTRA else None
+    item.options = options
+    item.lease = None
+    item._canonical = None
+    return item
+
+
+def _read(raw, offset, size):
+    length, = size.unpack_from(raw, offset)
+    offset += size.size
+    return raw[offset:offset+length], offset + length
+
+
+def _dumps_batch(codec, items, compress):
+    records = []
+    for item in items:
+        record = codec.dumps(item)
+        records.append(_u32.pack(len(record)))
+        records.append(record)
+    body = b''.join(records)
+    if compress:
+        body = zlib.compress(body)
+    head = _batch_head.pack(BATCH_MAGIC, VERSION, bool(compress),
+                            len(records) // 2)
+    return head + body
+
+
+def _loads_batch(codec, raw):
+    raw = bytes(raw)
+    magic, version, compressed, count = _batch_head.unpack_from(raw)
+    if magic != BATCH_MAGIC or version != VERSION:
+        raise ValueError('not a batch of version {}'.format(VERSION))
+    body = raw[_batch_head.size:]
+    if compressed:
+        body = zlib.decompress(body)
+    items, offset = [], 0
+    for _ in range(count):
+        record, offset = _read(body, offset, _u32)
+        items.append(codec.loads(record))
+    return items
+
+
+def batch_count(raw):
+    # return: count of items in a batch, only the head is needed
+    _, _, _, count = _batch_head.unpack_from(raw)
+    return count
+
+
+BATCH_HEAD_SIZE = _batch_head.size
+
+_codecs = {
+    PickleCodec.name: PickleCodec,
+    BinaryCodec.name: BinaryCodec,
+}
+
+
+def get_codec(settings):
+    name = settings.get('codec', 'pickle')
+    try:
+        return _codecs[name]()
+    except KeyError:
+        raise ValueError('unknown codec {}'.format(name))
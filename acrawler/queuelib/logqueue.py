@@ -0,0 +1,279 @@
+'''append only log queue, no SQL engine is used
+
+every priority is a chain of fixed-size segment files, records are
+appended sequentially and read through mmap. a record is a u32 length
+and a u32 crc32 followed by the encoded item, zero length or a wrong
+checksum means end of written data, so a torn tail is never read.
+the read cursor is checkpointed in a small file, fully consumed
+segments are deleted. write position and size are recovered by
+scanning records from the read cursor on open.
+'''
+
+import os
+import re
+import mmap
+import time
+import zlib
+import struct
+import logging
+from pathlib import Path
+
+from .base import BaseQueue, QueueEmpty
+from .codec import get_codec
+
+
+logger = logging.getLogger('Scheduler.Queue')
+
+_head = struct.Struct('>II')   # length, crc32 of item
+# read_seq, read_offset, write_seq, write_offset, size
+_cursor = struct.Struct('>QQQQQ')
+
+
+class Segment:
+    def __init__(self, path, size):
+        self.path = path
+        exists = path.is_file()
+        self._fd = path.open('r+b' if exists else 'w+b')
+        # a short file cannot be mapped, extend it with zeros
+        if os.fstat(self._fd.fileno()).st_size < size:
+            self._fd.truncate(size)
+        self.map = mmap.mmap(self._fd.fileno(), size)
+
+    def close(self, remove=False):
+        self.map.flush()
+        self.map.close()
+        self._fd.close()
+        if remove:
+            self.path.unlink()
+
+
+class PriorityLog:
+    def __init__(self, path, basename, priority, segment_size, codec):
+        self._path = path
+        self._prefix = '{}_{}'.format(basename, priority)
+        self._segment_size = segment_size
+        self._codec = codec
+        self._cursor_file = path / (self._prefix + '.cursor')
+        self._segments = {}     # seq -> Segment, opened segments
+        # only read position of cursor is trusted, others are recovered
+        (self.read_seq, self.read_offset, self.write_seq,
+         self.write_offset, self.size) = self._load_cursor()
+        self._recover()
+
+    def _segment_path(self, seq):
+        return self._path / '{}_{:08d}.log'.format(self._prefix, seq)
+
+    def _segment(self, seq):
+        segment = self._segments.get(seq)
+        if segment is None:
+            segment = Segment(self._segment_path(seq), self._segment_size)
+            self._segments[seq] = segment
+        return segment
+
+    def _existing_seqs(self):
+        pattern = re.escape(self._prefix) + r'_(?P<s>\d+)\.log$'
+        seqs = []
+        for child in self._path.iterdir():
+            m = re.match(pattern, child.name)
+            if m:
+                seqs.append(int(m.group('s')))
+        return sorted(seqs)
+
+    def _load_cursor(self):
+        if self._cursor_file.is_file():
+            raw = self._cursor_file.read_bytes()
+            if len(raw) == _cursor.size:
+                return _cursor.unpack(raw)
+        seqs = self._existing_seqs()
+        first = seqs[0] if seqs else 0
+        return first, 0, first, 0, 0
+
+    def _recover(self):
+        # count records from read cursor, records appended after last
+        # checkpoint are found and the size is right even if a segment
+        # was deleted before the cursor was saved
+        seqs = [s for s in self._existing_seqs() if s >= self.read_seq]
+        self.size = 0
+        if not seqs:
+            self.read_seq = self.write_seq = max(self.read_seq,
+                                                 self.write_seq)
+            self.read_offset = self.write_offset = 0
+            return
+        if seqs[0] != self.read_seq:
+            self.read_seq, self.read_offset = seqs[0], 0
+        self.write_seq, self.write_offset = self.read_seq, self.read_offset
+        for seq in seqs:
+            if seq != self.write_seq:
+                self.write_seq, self.write_offset = seq, 0
+            view = self._segment(seq).map
+            while True:
+                raw = self._record(view, self.write_offset)
+                if raw is None:
+                    break
+                self.write_offset += _head.size + len(raw)
+                self.size += 1
+            if seq not in (self.read_seq, seqs[-1]):
+                self._release(seq)
+
+    def _record(self, view, offset):
+        # return: item at offset, None if no valid record is there
+        if offset + _head.size > self._segment_size:
+            return None
+        length, crc = _head.unpack_from(view, offset)
+        start = offset + _head.size
+        if not length or start + length > self._segment_size:
+            return None
+        raw = view[start:start+length]
+        if zlib.crc32(raw) != crc:
+            return None
+        return raw
+
+    def put(self, raw):
+        need = _head.size + len(raw)
+        if need > self._segment_size:
+            logger.error('record is larger than segment, dropped')
+            return False
+        if self.write_offset + need > self._segment_size:
+            self._release(self.write_seq)
+            self.write_seq += 1
+            self.write_offset = 0
+        view = self._segment(self.write_seq).map
+        offset = self.write_offset
+        view[offset+_head.size:offset+need] = raw
+        # pages may be flushed in any order, checksum detects torn ones
+        _head.pack_into(view, offset, len(raw), zlib.crc32(raw))
+        self.write_offset += need
+        self.size += 1
+        return True
+
+    def get(self, count):
+        records = []
+        while len(records) < count and self.size > 0:
+            if self.read_seq == self.write_seq \
+                    and self.read_offset >= self.write_offset:
+                break
+            view = self._segment(self.read_seq).map
+            raw = self._record(view, self.read_offset)
+            if raw is None:
+                if self.read_seq >= self.write_seq:
+                    break
+                # segment is fully consumed
+                self._release(self.read_seq, remove=True)
+                self.read_seq += 1
+                self.read_offset = 0
+                self.checkpoint()
+                continue
+            records.append(raw)
+            self.read_offset += _head.size + len(raw)
+            self.size -= 1
+        return records
+
+    def _release(self, seq, remove=False):
+        segment = self._segments.pop(seq, None)
+        if segment is not None:
+            segment.close(remove=remove)
+        elif remove and self._segment_path(seq).is_file():
+            self._segment_path(seq).unlink()
+
+    def checkpoint(self):
+        tmp = self._cursor_file.with_name(self._cursor_file.name + '.tmp')
+        tmp.write_bytes(_cursor.pack(
+            self.read_seq, self.read_offset,
+            self.write_seq, self.write_offset, self.size))
+        tmp.replace(self._cursor_file)
+
+    def close(self):
+        self.checkpoint()
+        for seq in list(self._segments):
+            self._release(seq)
+
+
+class LogPriorityQueue(BaseQueue):
+
+    def __init__(self, settings, loop=None):
+        super().__init__(loop=loop)
+        self._closed = False
+        self._settings = settings
+        self._path = Path(settings.get('log_path', './task'))
+        if not self._path.is_dir():
+            self._path.mkdir()
+        self._basename = settings.get('log_dbname', 'log')
+        self._segment_size = settings.get('segment_size', 64 * 1024 * 1024)
+        self._checkpoint_interval = settings.get('commit_interval', 1)
+        self._last_checkpoint = time.monotonic()
+        self._codec = get_codec(settings)
+        self._logs = {}
+        self._resume()
+
+    def _resume(self):
+        pattern = re.escape(self._basename) + \
+            r'_(?P<p>-?\d+)(_\d+\.log|\.cursor)$'
+        for child in self._path.iterdir():
+            m = re.match(pattern, child.name)
+            if m:
+                self._log(int(m.group('p')))
+
+    def _log(self, priority):
+        log = self._logs.get(priority)
+        if log is None:
+            log = PriorityLog(self._path, self._basename, priority,
+                              self._segment_size, self._codec)
+            self._logs[priority] = log
+        return log
+
+    def _put(self, items):
+        putted = False
+        for item in items:
+            try:
+                raw = self._codec.dumps(item)
+            except Exception as e:
+                logger.error('Serialze Error, {}'.format(e))
+                continue
+            putted = self._log(item.priority).put(raw) or putted
+        return putted
+
+    def _get(self, count=1):
+        items = []
+        for priority in sorted(self._logs):
+            for raw in self._logs[priority].get(count - len(items)):
+                try:
+                    items.append(self._codec.loads(raw))
+                except Exception as e:
+                    logger.error(e)
+            if len(items) >= count:
+                break
+        if not items:
+            raise QueueEmpty()
+        return items
+
+    def qsize(self):
+        return sum(log.size for log in self._logs.values())
+
+    def commit(self):
+        # mmaped pages are flushed by OS, only cursor is checkpointed
+        now = time.monotonic()
+        if now - self._last_checkpoint < self._checkpoint_interval:
+            return
+        self._last_checkpoint = now
+        for log in self._logs.values():
+            log.checkpoint()
+
+    @staticmethod
+    def clean(settings):
+        path = Path(settings.get('log_path', './task'))
+        if not path.is_dir():
+            return
+        basename = settings.get('log_dbname', 'log')
+        for pattern in ('_*.log', '_*.cursor'):
+            for f in path.glob(basename + pattern):
+                f.unlink()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            for log in self._logs.values():
+                log.close()
+
+    def __del__(self):
+        if not self._closed:
+            self.close()
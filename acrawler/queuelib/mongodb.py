@@ -1,7 +1,8 @@
 import logging
 import pymongo
 
-from .base import BaseQueue, Empty, serialze, unserialze
+from .base import BaseQueue, QueueEmpty
+from .codec import get_codec
 
 
 logger = logging.getLogger(name='Scheduler.Queue')
@@ -9,14 +10,15 @@ logger = logging.getLogger(name='Scheduler.Queue')
 
 class PriorityMongoQueue(BaseQueue):
 
-    def __init__(self, settings, maxsize=0, loop=None):
-        super(PriorityMongoQueue, self).__init__(maxsize=maxsize, loop=loop)
+    def __init__(self, settings, loop=None):
+        super(PriorityMongoQueue, self).__init__(loop=loop)
         self._settings = settings
         config = settings['mongo_config']
         self._client = pymongo.MongoClient(**config)
         self._db = self._client.get_database(settings['mongo_dbname'])
         self._priorities = set()
         self._basename = settings['mongo_collectionname']
+        self._codec = get_codec(settings)
         if self._db.collection_names():
             self._resume()
 
@@ -31,17 +33,23 @@ class PriorityMongoQueue(BaseQueue):
             self._priorities.add(priority)
         return '{}_{}'.format(self._basename, priority)
 
-    def _put(self, item):
-        try:
-            serialzed = serialze(item)
-        except Exception as e:
-            logger.error('Serialze Error, {}'.format(e))
-            return
-        data = {'url': item.url, 'priority': item.priority,
-                'created': item.created, 'last_activated': item.last_activated,
-                'retryed': item.retryed, 'serialzed': serialzed}
-        col = self._db.get_collection(self._get_collection(item.priority))
-        col.insert_one(data)
+    def _put(self, items):
+        putted = False
+        for item in items:
+            try:
+                serialzed = self._codec.dumps(item)
+            except Exception as e:
+                logger.error('Serialze Error, {}'.format(e))
+                continue
+            data = {'url': item.url, 'priority': item.priority,
+                    'created': item.created,
+                    'last_activated': item.last_activated,
+                    'retryed': item.retryed, 'serialzed': serialzed}
+            col = self._db.get_collection(
+                    self._get_collection(item.priority))
+            col.insert_one(data)
+            putted = True
+        return putted
 
     def _get(self, count=1):
         for priority in sorted(self._priorities):
@@ -49,12 +57,12 @@ class PriorityMongoQueue(BaseQueue):
             result = col.find_one_and_delete({}, {'_id': 0})
             if result:
                 try:
-                    unserialzed = unserialze(result['serialzed'])
+                    unserialzed = self._codec.loads(result['serialzed'])
                 except Exception as e:
                     logger.error('Unserialze Error, {}'.format(e))
                 else:
                     return [unserialzed]
-        raise Empty()
+        raise QueueEmpty()
 
     @staticmethod
     def clean(settings):
@@ -1,17 +1,19 @@
 from collections import deque, defaultdict
 
-from .base import BaseQueue
+from .base import BaseQueue, QueueEmpty
 
 
 class PriorityQueue(BaseQueue):
+    blocking = False
 
-    def __init__(self, settings, maxsize=0, loop=None):
-        super().__init__(maxsize=maxsize, loop=loop)
+    def __init__(self, settings, loop=None):
+        super().__init__(loop=loop)
         self._settings = settings
         self._prioritys = dict()
         self._total = 0
 
     def _put(self, items):
+        putted = False
         for item in items:
             priority = item.priority
             if priority in self._prioritys:
@@ -21,6 +23,8 @@ class PriorityQueue(BaseQueue):
                 self._prioritys[priority] = queue
             queue.append(item)
             self._total += 1
+            putted = True
+        return putted
 
     def _get(self, count=1):
         remains = count
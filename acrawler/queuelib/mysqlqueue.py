@@ -3,7 +3,8 @@ import logging
 import pymysql
 
 from datetime import datetime
-from .base import BaseQueue, Empty, serialze, unserialze
+from .base import BaseQueue, QueueEmpty
+from .codec import get_codec
 
 
 logger = logging.getLogger('Scheduler.Queue')
@@ -37,6 +38,7 @@ class PriorityMysqlQueue(BaseQueue):
         self.maxsize = maxsize
         self._settings = settings
         self._basename = settings['mysql_tablename']
+        self._codec = get_codec(settings)
         config = settings['mysql_config']
         self._db = pymysql.connect(**config)
         self._priorities = set()
@@ -73,25 +75,29 @@ class PriorityMysqlQueue(BaseQueue):
             cur.close()
         self._priorities.add(priority)
 
-    def _put(self, request):
-        try:
-            serialzed = serialze(request)
-        except Exception as e:
-            logger.error('Serialze Error, {}'.format(e))
-            return
-        priority = request.priority
-        if priority not in self._priorities:
-            self._create_table(priority)
-        query = self._insert.format(self._make_table_name(priority))
+    def _put(self, requests):
+        putted = False
         cur = self._db.cursor()
         try:
-            cur.execute(query, (request.url, priority,
-                                to_timestamp(request.created),
-                                to_timestamp(request.last_activated),
-                                request.retryed, serialzed))
-            self._total += 1
+            for request in requests:
+                try:
+                    serialzed = self._codec.dumps(request)
+                except Exception as e:
+                    logger.error('Serialze Error, {}'.format(e))
+                    continue
+                priority = request.priority
+                if priority not in self._priorities:
+                    self._create_table(priority)
+                query = self._insert.format(self._make_table_name(priority))
+                cur.execute(query, (request.url, priority,
+                                    to_timestamp(request.created),
+                                    to_timestamp(request.last_activated),
+                                    request.retryed, serialzed))
+                self._total += 1
+                putted = True
         finally:
             cur.close()
+        return putted
 
     def _get(self, count=1):
         assert count >= 1
@@ -112,7 +118,7 @@ class PriorityMysqlQueue(BaseQueue):
             temp = []
             for item in result:
                 try:
-                    unserialzed = unserialze(item[6])
+                    unserialzed = self._codec.loads(item[6])
                     cur.execute(query, (item[0],))
                     self._total -= 1
                 except Exception as e:
@@ -125,7 +131,7 @@ class PriorityMysqlQueue(BaseQueue):
             if remain <= 0:
                 return items
         if not items:
-            raise Empty()
+            raise QueueEmpty()
         return items
 
     @staticmethod
@@ -145,6 +151,9 @@ class PriorityMysqlQueue(BaseQueue):
     def qsize(self):
         return self._total
 
+    def commit(self):
+        self._db.commit()
+
     def close(self):
         self._closed = True
         self._db.commit()
@@ -0,0 +1,254 @@
+'''memory first priority queue, spills overflow to disk in batches
+
+items of each priority are kept in three parts, oldest first:
+head (memory) -> spilled batches (file) -> tail (memory)
+'''
+
+import re
+import struct
+import logging
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import BaseQueue, QueueEmpty
+from .codec import get_codec, batch_count, BATCH_HEAD_SIZE
+
+
+logger = logging.getLogger('Scheduler.Queue')
+
+_u32 = struct.Struct('>I')
+
+
+class Segment:
+    def __init__(self, path, codec, compress):
+        self.path = path
+        self.codec = codec
+        self.compress = compress
+        self.head = deque()
+        self.tail = deque()
+        self.spilled = 0        # count of items on disk
+        self.prefetch = None    # future of the next batch
+        # following are only touched in I/O thread
+        self._batches = deque()     # (offset, length) of unread batches
+        self._fd = None
+        self._end = 0
+        self._resume()
+
+    def _open(self):
+        if self._fd is None:
+            mode = 'r+b' if self.path.is_file() else 'w+b'
+            self._fd = self.path.open(mode)
+        return self._fd
+
+    def _resume(self):
+        if not self.path.is_file():
+            return
+        fd = self._open()
+        offset, size = 0, _u32.size + BATCH_HEAD_SIZE
+        while True:
+            fd.seek(offset)
+            raw = fd.read(size)
+            if len(raw) < size:
+                break
+            length, = _u32.unpack_from(raw)
+            self._batches.append((offset + _u32.size, length))
+            self.spilled += batch_count(raw[_u32.size:])
+            offset += _u32.size + length
+        self._end = offset
+
+    def write(self, items):
+        raw = self.codec.dumps_batch(items, self.compress)
+        fd = self._open()
+        fd.seek(self._end)
+        fd.write(_u32.pack(len(raw)))
+        fd.write(raw)
+        self._batches.append((self._end + _u32.size, len(raw)))
+        self._end += _u32.size + len(raw)
+
+    def read(self):
+        offset, length = self._batches.popleft()
+        fd = self._open()
+        fd.seek(offset)
+        items = self.codec.loads_batch(fd.read(length))
+        if not self._batches:   # all consumed, reuse the file
+            fd.truncate(0)
+            self._end = 0
+        return items
+
+    def persist(self, head):
+        # rewrite file as: head, unread batches, tail
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        written = False
+        with tmp.open('wb') as out:
+            def write_raw(raw):
+                out.write(_u32.pack(len(raw)))
+                out.write(raw)
+            if head:
+                write_raw(self.codec.dumps_batch(head, self.compress))
+                written = True
+            for offset, length in self._batches:
+                self._fd.seek(offset)
+                write_raw(self._fd.read(length))
+                written = True
+            if self.tail:
+                write_raw(self.codec.dumps_batch(self.tail, self.compress))
+                written = True
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        if written:
+            tmp.replace(self.path)
+        else:
+            tmp.unlink()
+            if self.path.is_file():
+                self.path.unlink()
+
+
+class SpillPriorityQueue(BaseQueue):
+    # disk I/O is done in its own thread, dispatch runs at memory speed
+    blocking = False
+
+    def __init__(self, settings, loop=None):
+        super().__init__(loop=loop)
+        self._closed = False
+        self._settings = settings
+        self._path = Path(settings.get('spill_path', './task'))
+        if not self._path.is_dir():
+            self._path.mkdir()
+        self._basename = settings.get('spill_dbname', 'spill')
+        self._high_water = settings.get('memory_size', 100000)
+        self._batch_size = settings.get('spill_batch', 1000)
+        self._compress = settings.get('spill_compress', True)
+        self._codec = get_codec(settings)
+        self._io = ThreadPoolExecutor(max_workers=1)
+        self._segments = {}
+        self._memory = 0
+        self._waiting = None    # read the caller has to wait for
+        self._resume()
+
+    def _resume(self):
+        pattern = re.escape(self._basename) + r'_(?P<p>-?\d+)\.spill$'
+        for child in self._path.iterdir():
+            m = re.match(pattern, child.name)
+            if m:
+                self._segment(int(m.group('p')))
+
+    def _segment(self, priority):
+        segment = self._segments.get(priority)
+        if segment is None:
+            name = '{}_{}.spill'.format(self._basename, priority)
+            segment = Segment(self._path / name, self._codec, self._compress)
+            self._segments[priority] = segment
+        return segment
+
+    def _put(self, items):
+        putted = False
+        for item in items:
+            segment = self._segment(item.priority)
+            if segment.spilled or segment.tail:
+                segment.tail.append(item)
+            else:
+                segment.head.append(item)
+            self._memory += 1
+            putted = True
+        if self._memory > self._high_water:
+            self._spill()
+        return putted
+
+    def _spill(self):
+        # spill the least urgent priorities first
+        target = max(self._high_water - self._batch_size, 0)
+        for priority in sorted(self._segments, reverse=True):
+            if self._memory <= target:
+                break
+            segment = self._segments[priority]
+            if not segment.spilled:
+                # nothing on disk, the newest items of head become tail
+                need = self._memory - target
+                while segment.head and len(segment.tail) < need:
+                    segment.tail.appendleft(segment.head.pop())
+            while segment.tail and self._memory > target:
+                count = min(self._batch_size, len(segment.tail))
+                items = [segment.tail.popleft() for _ in range(count)]
+                self._memory -= count
+                segment.spilled += count
+                self._io.submit(segment.write, items)
+
+    def _refill(self, segment):
+        # return: False if the batch is still being read, never block
+        if segment.prefetch is None:
+            segment.prefetch = self._io.submit(segment.read)
+        if not segment.prefetch.done():
+            self._waiting = segment.prefetch
+            return False
+        items = segment.prefetch.result()
+        segment.prefetch = None
+        segment.spilled -= len(items)
+        segment.head.extend(items)
+        self._memory += len(items)
+        return True
+
+    def _prefetch(self, segment):
+        # read next batch in background before head is drained
+        if segment.spilled and segment.prefetch is None \
+                and len(segment.head) < self._batch_size:
+            segment.prefetch = self._io.submit(segment.read)
+
+    def _get(self, count=1):
+        # items of lower priority are not returned while a batch of
+        # higher priority is being read, wait for _pending() instead
+        items = []
+        self._waiting = None
+        for priority in sorted(self._segments):
+            segment = self._segments[priority]
+            while len(items) < count:
+                if segment.head:
+                    items.append(segment.head.popleft())
+                    self._memory -= 1
+                elif segment.spilled:
+                    if not self._refill(segment):
+                        break
+                elif segment.tail:
+                    segment.head, segment.tail = segment.tail, segment.head
+                else:
+                    break
+            self._prefetch(segment)
+            if len(items) >= count or self._waiting is not None:
+                break
+        if not items:
+            raise QueueEmpty()
+        return items
+
+    def _pending(self):
+        return self._waiting
+
+    def qsize(self):
+        spilled = sum(s.spilled for s in self._segments.values())
+        return self._memory + spilled
+
+    @staticmethod
+    def clean(settings):
+        path = Path(settings.get('spill_path', './task'))
+        if not path.is_dir():
+            return
+        basename = settings.get('spill_dbname', 'spill')
+        for f in path.glob(basename + '_*.spill'):
+            f.unlink()
+
+    def close(self):
+        # persist all items, memory parts are written around the spilled
+        if self._closed:
+            return
+        self._closed = True
+        self._io.shutdown(wait=True)
+        for segment in self._segments.values():
+            head = list(segment.head)
+            if segment.prefetch is not None:
+                head.extend(segment.prefetch.result())
+            segment.persist(head)
+        self._memory = 0
+
+    def __del__(self):
+        if not self._closed:
+            self.close()
@@ -1,11 +1,13 @@
 import re
+import time
 import sqlite3
 import asyncio
 import logging
 from collections import defaultdict
 from pathlib import Path
 
-from .base import QueueEmpty, BaseQueue, serialze, unserialze
+from .base import QueueEmpty, BaseQueue
+from .codec import get_codec
 
 
 logger = logging.getLogger(name='Scheduler.Queue')
@@ -20,13 +22,47 @@ _sql_create = ('CREATE TABLE IF NOT EXISTS queue '
                ' retryed INTEGER,'
                ' serialzed BLOB)')
 _sql_size = 'SELECT COUNT(*) FROM queue'
-_sql_push = ('INSERT INTO queue '
-             '(url, priority, created,'
-             ' last_activated, retryed, serialzed) '
-             'VALUES (?,?,?,?,?,?)')
+# other columns are kept for old databases, all data is in serialzed
+_sql_push = 'INSERT INTO queue (priority, serialzed) VALUES (?,?)'
 _sql_pop = 'SELECT id,serialzed FROM queue ORDER BY id LIMIT ?'
 _sql_del = 'DELETE FROM queue WHERE id = ?'
 
+# single database queue, pop by the (priority, id) index, leased rows
+# stay in table until they are acked
+_sql_wal_create = ('CREATE TABLE IF NOT EXISTS queue '
+                   '(id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                   ' priority INTEGER NOT NULL,'
+                   ' serialzed BLOB NOT NULL,'
+                   ' leased_until REAL NOT NULL DEFAULT 0)')
+_sql_wal_columns = 'PRAGMA table_info(queue)'
+_sql_wal_add_lease = ('ALTER TABLE queue ADD COLUMN '
+                      'leased_until REAL NOT NULL DEFAULT 0')
+_sql_wal_index = ('CREATE INDEX IF NOT EXISTS queue_ready '
+                  'ON queue (priority, id) WHERE leased_until = 0')
+_sql_wal_lease_index = ('CREATE INDEX IF NOT EXISTS queue_leased '
+                        'ON queue (leased_until) WHERE leased_until > 0')
+_sql_wal_push = 'INSERT INTO queue (priority, serialzed) VALUES (?,?)'
+_sql_wal_ready = ('SELECT id FROM queue WHERE leased_until = 0 '
+                  'ORDER BY priority, id LIMIT ?')
+_sql_wal_pop = ('DELETE FROM queue WHERE id IN ({}) '
+                'RETURNING priority, id, serialzed').format(_sql_wal_ready)
+_sql_wal_lease = ('UPDATE queue SET leased_until = ? WHERE id IN ({}) '
+                  'RETURNING priority, id, serialzed').format(_sql_wal_ready)
+_sql_wal_select = ('SELECT priority, id, serialzed FROM queue '
+                   'WHERE leased_until = 0 ORDER BY priority, id LIMIT ?')
+_sql_wal_del = 'DELETE FROM queue WHERE id IN ({})'
+_sql_wal_set_lease = 'UPDATE queue SET leased_until = ? WHERE id IN ({})'
+_sql_wal_expire = ('UPDATE queue SET leased_until = 0 '
+                   'WHERE leased_until > 0 AND leased_until < ?')
+_sql_wal_expired = ('SELECT id FROM queue '
+                    'WHERE leased_until > 0 AND leased_until < ?')
+_sql_wal_renew = ('UPDATE queue SET leased_until = ? '
+                  'WHERE leased_until > 0 AND id IN ({})')
+# max count of variables in one statement of old SQLite
+_max_variables = 900
+# RETURNING clause is supported since SQLite 3.35
+_has_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
 
 class SQLite:
     def ensure_tuple(self, data):
@@ -80,6 +116,7 @@ class FifoSQLiteQueue(SQLite, BaseQueue):
         self._path = settings.get('sqlite_path', './')
         self._name = settings.get('sqlite_dbname', 'task.db')
         self._dbfile = Path(self._path) / self._name
+        self._codec = get_codec(settings)
 
         self._db = sqlite3.Connection(str(self._dbfile), timeout=60)
         self._db.row_factory = sqlite3.Row
@@ -92,15 +129,11 @@ class FifoSQLiteQueue(SQLite, BaseQueue):
         records = []
         for item in items:
             try:
-                serialzed = serialze(item)
+                serialzed = self._codec.dumps(item)
             except Exception as e:
                 logger.error('Serialze Error, {}'.format(e))
                 continue
-            record = (
-                item.url, item.priority, item.created,
-                item.last_activated, item.retryed, serialzed
-                )
-            records.append(record)
+            records.append((item.priority, serialzed))
         self._execute_many(self._db, _sql_push, records)
         return len(records) > 0
 
@@ -108,7 +141,7 @@ class FifoSQLiteQueue(SQLite, BaseQueue):
         items, deletes = [], []
         for row in self._fetch_all(self._db, _sql_pop, (count,)):
             try:
-                unserialzed = unserialze(row['serialzed'])
+                unserialzed = self._codec.loads(row['serialzed'])
             except Exception as e:
                 logger.error(e)
                 continue
@@ -139,6 +172,9 @@ class FifoSQLiteQueue(SQLite, BaseQueue):
     def is_closed(self):
         return self._closed
 
+    def commit(self):
+        self._db.commit()
+
     def qsize(self):
         return self._fetch_one(self._db, _sql_size)
 
@@ -156,6 +192,7 @@ class PrioritySQLiteQueue(BaseQueue):
         self._queues = {}
         self._path = settings.get('sqlite_path', './')
         self._basename = settings.get('sqlite_dbname', 'task_priority')
+        self._codec = settings.get('codec', 'pickle')
         self._resume()
 
     def _get_db(self, path: Path):
@@ -167,7 +204,8 @@ class PrioritySQLiteQueue(BaseQueue):
                 priority = int(m.group('p'))
                 tmp = {
                     'sqlite_path': str(path),
-                    'sqlite_dbname': child.name
+                    'sqlite_dbname': child.name,
+                    'codec': self._codec
                 }
                 yield priority, FifoSQLiteQueue(tmp, loop=self._loop)
 
@@ -181,7 +219,8 @@ class PrioritySQLiteQueue(BaseQueue):
 
     def _create_queue(self, priority, loop=None):
         name = '{}_{}.db'.format(self._basename, priority)
-        tmp = {'sqlite_path': self._path, 'sqlite_dbname': name}
+        tmp = {'sqlite_path': self._path, 'sqlite_dbname': name,
+               'codec': self._codec}
         queue = FifoSQLiteQueue(tmp, loop=loop)
         self._queues[priority] = queue
         return queue
@@ -196,7 +235,7 @@ class PrioritySQLiteQueue(BaseQueue):
                 queue = self._create_queue(priority, loop=self._loop)
             else:
                 queue = self._queues.get(priority)
-            putted = putted or queue.put(requests)
+            putted = queue._put(requests) or putted
         return putted
 
     def _get(self, count):
@@ -233,6 +272,10 @@ class PrioritySQLiteQueue(BaseQueue):
             if f.match(basename+'_*.db'):
                 f.unlink()
 
+    def commit(self):
+        for queue in self._queues.values():
+            queue.commit()
+
     def close(self):
         self._closed = True
         for queue in self._queues.values():
@@ -240,3 +283,159 @@ class PrioritySQLiteQueue(BaseQueue):
 
     def is_closed(self):
         return self._closed
+
+
+class WALPrioritySQLiteQueue(SQLite, BaseQueue):
+    '''all priorities in one WAL mode database, size of queue is counted
+    in memory, changes are committed by count or interval
+    '''
+
+    def __init__(self, settings, loop=None):
+        BaseQueue.__init__(self, loop=loop)
+        self._closed = False
+        self._settings = settings
+        path = Path(settings.get('sqlite_path', './'))
+        if not path.is_dir():
+            path.mkdir()
+        self._dbfile = path / settings.get('sqlite_dbname', 'queue.db')
+        self._codec = get_codec(settings)
+        self._commit_count = settings.get('commit_count', 1000)
+        self._commit_interval = settings.get('commit_interval', 1)
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        # leased items are deleted only when acked, None to disable
+        self._lease_timeout = settings.get('lease_timeout')
+
+        self._db = sqlite3.Connection(str(self._dbfile), timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._execute(self._db, _sql_wal_create)
+        columns = [r[1] for r in self._fetch_all(self._db, _sql_wal_columns)]
+        if 'leased_until' not in columns:
+            self._execute(self._db, _sql_wal_add_lease)
+        self._execute(self._db, _sql_wal_index)
+        self._execute(self._db, _sql_wal_lease_index)
+        # leases of last run are expired, deliver them again
+        self._execute(self._db, _sql_wal_expire, (float('inf'),))
+        self._db.commit()
+        self._total = self._fetch_one(self._db, _sql_size)
+
+    def _put(self, items):
+        records = []
+        for item in items:
+            try:
+                serialzed = self._codec.dumps(item)
+            except Exception as e:
+                logger.error('Serialze Error, {}'.format(e))
+                continue
+            records.append((item.priority, serialzed))
+        if not records:
+            return False
+        self._execute_many(self._db, _sql_wal_push, records)
+        self._total += len(records)
+        self._uncommitted += len(records)
+        return True
+
+    def _pop(self, count):
+        # leased rows are only marked, others are deleted
+        if self._lease_timeout:
+            leased_until = time.time() + self._lease_timeout
+            if _has_returning:
+                return list(self._fetch_all(
+                    self._db, _sql_wal_lease, (leased_until, count)))
+            query, data = _sql_wal_set_lease, (leased_until, )
+        else:
+            if _has_returning:
+                return list(self._fetch_all(self._db, _sql_wal_pop, (count,)))
+            query, data = _sql_wal_del, ()
+        rows = list(self._fetch_all(self._db, _sql_wal_select, (count,)))
+        if rows:
+            query = query.format(','.join('?' * len(rows)))
+            self._execute(self._db, query, data + tuple(r[1] for r in rows))
+        return rows
+
+    def _get(self, count=1):
+        rows = self._pop(count)
+        self._total -= len(rows)
+        self._uncommitted += len(rows)
+        items = []
+        # rows returned by RETURNING are not ordered
+        for _, id, serialzed in sorted(rows, key=lambda r: r[:2]):
+            try:
+                item = self._codec.loads(serialzed)
+            except Exception as e:
+                logger.error(e)
+                continue
+            item.lease = id if self._lease_timeout else None
+            items.append(item)
+        if not items:
+            raise QueueEmpty()
+        return items
+
+    def _execute_in(self, query, ids, data=()):
+        ids = tuple(ids)
+        for i in range(0, len(ids), _max_variables):
+            chunk = ids[i:i+_max_variables]
+            self._execute(self._db, query.format(','.join('?' * len(chunk))),
+                          data + chunk)
+
+    def _ack(self, leases):
+        self._execute_in(_sql_wal_del, leases)
+        self._uncommitted += len(leases)
+
+    def _renew(self, leases):
+        # lease clock restarts, items already expired are not touched
+        if not self._lease_timeout:
+            return
+        leased_until = time.time() + self._lease_timeout
+        self._execute_in(_sql_wal_renew, leases, (leased_until,))
+        self._uncommitted += len(leases)
+
+    def _expire(self):
+        # deliver items whose lease is timeout again, return their leases
+        if not self._lease_timeout:
+            return []
+        now = time.time()
+        expired = [r[0] for r in self._fetch_all(
+                self._db, _sql_wal_expired, (now,))]
+        if expired:
+            self._execute_in(_sql_wal_set_lease, expired, (0,))
+            logger.warning('{} leases expired'.format(len(expired)))
+            self._total += len(expired)
+            self._uncommitted += len(expired)
+        return expired
+
+    def commit(self, force=False):
+        now = time.monotonic()
+        if not force and self._uncommitted < self._commit_count \
+                and now - self._last_commit < self._commit_interval:
+            return
+        if self._uncommitted:
+            self._db.commit()
+        self._uncommitted = 0
+        self._last_commit = now
+
+    def qsize(self):
+        return self._total
+
+    @staticmethod
+    def clean(settings):
+        dbpath = Path(settings.get('sqlite_path', './'))
+        dbfile = dbpath / settings.get('sqlite_dbname', 'queue.db')
+        for suffix in ('', '-wal', '-shm'):
+            f = dbfile.with_name(dbfile.name + suffix)
+            if f.is_file():
+                f.unlink()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.commit(force=True)
+            self._db.close()
+
+    def is_closed(self):
+        return self._closed
+
+    def __del__(self):
+        if not self._closed:
+            self.close()
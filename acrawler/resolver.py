@@ -0,0 +1,153 @@
+'''caching DNS resolver of the http session
+
+answers and failures are cached with their own ttl in a bounded LRU,
+concurrent lookups of a host share one query, hosts of newly scheduled
+requests can be resolved before they are fetched
+'''
+
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+
+from collections import OrderedDict
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+
+logger = logging.getLogger('Engine.Resolver')
+
+
+def is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class ResolverStats:
+    __slots__ = ['lookups', 'hits', 'negative_hits', 'misses', 'queries',
+                 'failures', 'prefetches', 'latency', 'max_latency']
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def observe(self, latency):
+        self.queries += 1
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def as_dict(self):
+        stats = {name: getattr(self, name) for name in self.__slots__}
+        stats['avg_latency'] = (
+                self.latency / self.queries if self.queries else 0)
+        return stats
+
+    def __str__(self):
+        return ('lookups={lookups} hits={hits} '
+                'negative_hits={negative_hits} misses={misses} '
+                'queries={queries} failures={failures} '
+                'prefetches={prefetches} avg_latency={avg_latency:.4f}s '
+                'max_latency={max_latency:.4f}s').format(**self.as_dict())
+
+
+class CachingResolver(AbstractResolver):
+    '''param upstream: resolver does the real query, any object has
+    coroutine resolve(host, port, family) and close() can be used
+    '''
+
+    def __init__(self, settings, upstream=None, loop=None):
+        self._loop = asyncio.get_event_loop() if not loop else loop
+        self._upstream = upstream or aiohttp.DefaultResolver()
+        self._ttl = settings.get('dns_cache_ttl', 300)
+        self._negative_ttl = settings.get('dns_negative_ttl', 30)
+        self._max_size = settings.get('dns_cache_size', 10000)
+        self._max_prefetch = settings.get('dns_prefetch_limit', 100)
+        # (host, family) -> (expires, answers or exception)
+        self._cache = OrderedDict()
+        self._pending = {}      # (host, family) -> task of the query
+        self.stats = ResolverStats()
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _store(self, key, result, ttl):
+        self._cache[key] = (time.monotonic() + ttl, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+    async def _query(self, key):
+        host, family = key
+        start = time.monotonic()
+        try:
+            answers = await self._upstream.resolve(host, 0, family)
+        except OSError as e:
+            self.stats.failures += 1
+            self._store(key, e, self._negative_ttl)
+            raise
+        finally:
+            self.stats.observe(time.monotonic() - start)
+            self._pending.pop(key, None)
+        self._store(key, answers, self._ttl)
+        return answers
+
+    def _start(self, key):
+        task = self._pending.get(key)
+        if task is None:
+            task = self._loop.create_task(self._query(key))
+            task.add_done_callback(self._retrieve)
+            self._pending[key] = task
+        return task
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        self.stats.lookups += 1
+        key = (host, family)
+        entry = self._cached(key)
+        if entry is not None:
+            result = entry[1]
+            if isinstance(result, Exception):
+                self.stats.negative_hits += 1
+                raise type(result)(*result.args)
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+            # a cancelled fetch must not cancel the query of others
+            result = await asyncio.shield(self._start(key))
+        return [dict(answer, port=port) for answer in result]
+
+    def prefetch(self, hosts, family=socket.AF_UNSPEC):
+        # resolve hosts in background, they are fetched soon
+        for host in hosts:
+            if len(self._pending) >= self._max_prefetch:
+                return
+            key = (host, family)
+            if not host or is_ip(host) or key in self._pending \
+                    or self._cached(key) is not None:
+                continue
+            self.stats.prefetches += 1
+            self._start(key)
+
+    @staticmethod
+    def _retrieve(task):
+        # failure is cached, it is reported to every one who resolves
+        # the host, no one may wait for the query itself
+        if not task.cancelled():
+            task.exception()
+
+    async def close(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        await self._upstream.close()
@@ -1,60 +1,386 @@
+import time
+import heapq
 import logging
 import asyncio
 
 from collections import deque
-from .queuelib.base import QueueEmpty
+from .canonical import canonicalize
+from .storage import AsyncQueue, AsyncFilter
 
 
 logger = logging.getLogger('Scheduler')
 
 
+def get_host(url):
+    # keep the same key as BaseFilter.allowed
+    return canonicalize(url).host
+
+
+class HostSlot:
+    '''pending requests of one host, use a token bucket and a minimum
+    delay to limit how often the host can be fetched
+    '''
+    __slots__ = ['host', 'requests', 'delay', 'rate', 'burst',
+                 'tokens', 'updated', 'last_fetched']
+
+    def __init__(self, host, delay=0, rate=None, burst=1):
+        self.host = host
+        self.requests = deque()
+        self.delay = delay
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.last_fetched = None
+
+    def _refill(self, now):
+        if self.rate:
+            elapsed = now - self.updated
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def ready_at(self, now):
+        # return: the earliest time this host is allowed to fetch
+        self._refill(now)
+        at = now
+        if self.delay and self.last_fetched is not None:
+            at = max(at, self.last_fetched + self.delay)
+        if self.rate and self.tokens < 1:
+            at = max(at, now + (1 - self.tokens) / self.rate)
+        return at
+
+    def idle_at(self, now):
+        # return: the time after which a new slot of the host behaves
+        # the same as this one, so an empty slot can be dropped
+        self._refill(now)
+        at = now
+        if self.delay and self.last_fetched is not None:
+            at = max(at, self.last_fetched + self.delay)
+        if self.rate and self.tokens < self.burst:
+            at = max(at, now + (self.burst - self.tokens) / self.rate)
+        return at
+
+    def acquire(self, now):
+        self._refill(now)
+        if self.rate:
+            self.tokens -= 1
+        self.last_fetched = now
+        return self.requests.popleft()
+
+
 class Scheduler:
     def __init__(self, settings, FilterClass, QueueClass, loop=None):
         self._loop = asyncio.get_event_loop() if not loop else loop
-        self._urlfilter = FilterClass(settings['filter'])
-        self.fetchdiskq = QueueClass(settings['queue'], loop=loop)
-        self._cache_size = 10
+        # storage backends are called in their own thread if blocking
+        self._urlfilter = AsyncFilter(
+                FilterClass, settings['filter'], loop=self._loop)
+        self.fetchdiskq = AsyncQueue(
+                QueueClass, settings['queue'], loop=self._loop)
+        self._adding = set()
+        self._leases = []       # leases of done tasks, acked in batch
         self._settings = settings
-        self._caches = deque()  # use memory cache to reduce disk IO
+        # lease clock of a request starts when it is sent to spider,
+        # leases of cached requests are renewed until then
+        self._lease_timeout = settings.get('queue', {}).get('lease_timeout')
+        self._deadlines = {}    # lease -> deadline of cached requests
+        self._renewing = []     # leases of sent requests, renewed in batch
+        self._expiring = set()  # leases of dropped copies, not redelivered
+        self._lease_timer = None
+        self._leasing = None
+        if self._lease_timeout:
+            self._lease_timer = self._loop.call_later(
+                    self._lease_timeout / 2, self._on_lease_timer)
+        # requests are prefetched in background, batch size adapts to
+        # dispatch rate and latency of queue backend
+        self._min_cache_size = max(settings.get('prefetch_min') or 10, 1)
+        self._max_cache_size = max(settings.get('prefetch_max') or 500,
+                                   self._min_cache_size)
+        self._cache_size = self._min_cache_size
+        self._low_water = self._min_cache_size
+        self._interval = None   # moving average of dispatch interval
+        self._latency = None    # moving average of queue get latency
+        self._last_dispatch = None
+        self._refilling = None
+        # politeness settings, apply to every host
+        self._host_delay = settings.get('host_delay') or 0
+        self._host_rate = settings.get('host_rate')
+        self._host_burst = settings.get('host_burst') or 1
+        # max requests can be cached in memory while waiting for a host
+        self._max_cached = max(settings.get('max_cached', 1000),
+                               self._min_cache_size)
+        self._slots = {}        # host -> HostSlot
+        self._ready = []        # heap of (ready_at, seq, host)
+        self._idle = []         # heap of (idle_at, seq, host) of empty slots
+        self._seq = 0
+        self._cached = 0        # use memory cache to reduce disk IO
+        # hosts of requests fetched from queue are resolved in advance
+        # by resolver if it is set, they are about to be crawled
+        self.resolver = None
 
     def add(self, requests):
-        filted = filter(self._should_add, requests)
-        self.fetchdiskq.put(filted)
+        # return: a task which is done when requests were added
+        adding = self._loop.create_task(self._add(list(requests)))
+        self._adding.add(adding)
+        adding.add_done_callback(self._adding.discard)
+        return adding
 
-    def _should_add(self, request):
-        if request.filter_ignore:
-            logger.debug('add task<{}> ignore filter'.format(request.url))
-            return True
-        if self._urlfilter.allowed(request):
+    async def _add(self, requests):
+        # return: requests which were allowed and queued
+        if not requests:
+            return []
+        allowed = await self._urlfilter.allowed_many(requests)
+        if len(allowed) < len(requests):
+            logger.debug('{} tasks are not allowed'
+                         .format(len(requests) - len(allowed)))
+        await self.fetchdiskq.put(allowed)
+        return allowed
+
+    def ack(self, task):
+        # task is done, delete it from queue if it was leased
+        lease = getattr(task, 'lease', None)
+        if lease is None:
+            return
+        # a copy of task may be sent back, it must not carry the lease
+        task.lease = None
+        if not self._leases:
+            self._loop.call_soon(self._flush_leases)
+        self._leases.append(lease)
+
+    def _flush_leases(self):
+        if self._renewing:
+            renewing, self._renewing = self._renewing, []
+            self._track(self.fetchdiskq.renew(renewing))
+        if not self._leases:
+            return
+        leases, self._leases = self._leases, []
+        self._track(self._ack(leases, list(self._adding)))
+
+    def _track(self, coro):
+        task = self._loop.create_task(coro)
+        self._adding.add(task)
+        task.add_done_callback(self._adding.discard)
+
+    async def _ack(self, leases, adding):
+        # results of tasks must be stored before tasks are deleted
+        if adding:
+            await asyncio.wait(adding)
+        await self.fetchdiskq.ack(leases)
+
+    def _on_lease_timer(self):
+        # renew leases of cached requests, then expire timeout ones
+        self._lease_timer = self._loop.call_later(
+                self._lease_timeout / 2, self._on_lease_timer)
+        if self._leasing is not None:
+            return      # queue is slow, do not pile up
+        deadline = time.monotonic() + self._lease_timeout
+        cached = list(self._deadlines)
+        for lease in cached:
+            self._deadlines[lease] = deadline
+        self._leasing = self._loop.create_task(self._maintain_leases(cached))
+        self._leasing.add_done_callback(self._leasing_done)
+
+    async def _maintain_leases(self, cached):
+        if cached:
+            await self.fetchdiskq.renew(cached)
+        self._expiring.difference_update(await self.fetchdiskq.expire())
+
+    def _leasing_done(self, leasing):
+        self._leasing = None
+        if not leasing.cancelled() and leasing.exception():
+            logger.error('maintain leases failed, {}'
+                         .format(leasing.exception()))
+
+    async def join(self):
+        # wait for all adding and acking tasks
+        if self._lease_timer is not None:
+            self._lease_timer.cancel()
+            self._lease_timer = None
+        self._flush_leases()
+        while self._adding:
+            await asyncio.wait(list(self._adding))
+        # requests being prefetched are put back on close
+        waiting = [t for t in (self._refilling, self._leasing)
+                   if t is not None]
+        if waiting:
+            await asyncio.wait(waiting)
+
+    def _schedule(self, slot, now):
+        self._seq += 1
+        entry = (slot.ready_at(now), self._seq, slot.host)
+        heapq.heappush(self._ready, entry)
+
+    def _distribute(self, tasks):
+        now = time.monotonic()
+        for task in tasks:
+            host = task.canonical.host
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = HostSlot(host, self._host_delay,
+                                self._host_rate, self._host_burst)
+                self._slots[host] = slot
+            if not slot.requests:
+                self._schedule(slot, now)
+            slot.requests.append(task)
+            self._cached += 1
+        if self.resolver is not None:
+            self.resolver.prefetch({t.canonical.hostname for t in tasks})
+
+    def _expired(self, task, now):
+        # a cached copy whose lease may have expired is dropped, the
+        # queue delivers it again
+        lease = task.lease
+        if lease is None or lease not in self._deadlines:
+            return False
+        if self._deadlines[lease] - now >= self._lease_timeout / 4:
+            return False
+        del self._deadlines[lease]
+        self._expiring.add(lease)
+        logger.debug('lease of <{}> expired in cache'.format(task.url))
+        return True
+
+    def _pop_ready(self):
+        # return: a request whose host is allowed to fetch now, or None
+        now = time.monotonic()
+        while self._ready:
+            ready_at, _, host = self._ready[0]
+            if ready_at > now:
+                return None
+            heapq.heappop(self._ready)
+            slot = self._slots[host]
+            while slot.requests and self._expired(slot.requests[0], now):
+                slot.requests.popleft()
+                self._cached -= 1
+            if not slot.requests:
+                self._retire(slot, now)
+                continue
+            task = slot.acquire(now)
+            self._cached -= 1
+            if slot.requests:
+                self._schedule(slot, now)
+            else:
+                self._retire(slot, now)
+            self._purge(now)
+            if task.lease is not None:
+                # lease clock starts when spider gets the request
+                self._deadlines.pop(task.lease, None)
+                if not self._renewing and not self._leases:
+                    self._loop.call_soon(self._flush_leases)
+                self._renewing.append(task.lease)
+            return task
+        return None
+
+    def _retire(self, slot, now):
+        self._seq += 1
+        heapq.heappush(self._idle, (slot.idle_at(now), self._seq, slot.host))
+
+    def _purge(self, now):
+        # drop slots which are empty and whose limits have passed
+        while self._idle and self._idle[0][0] <= now:
+            _, _, host = heapq.heappop(self._idle)
+            slot = self._slots.get(host)
+            if slot is not None and not slot.requests \
+                    and slot.idle_at(now) <= now:
+                del self._slots[host]
+
+    def _should_fill(self):
+        return (self._cached < self._max_cached
+                and not self.fetchdiskq.empty())
+
+    @staticmethod
+    def _average(average, sample, alpha=0.2):
+        if average is None:
+            return sample
+        return average + alpha * (sample - average)
+
+    def _dispatched(self, now):
+        if self._last_dispatch is not None:
+            # long idle is not counted, the rate will restore quickly
+            interval = min(now - self._last_dispatch, 1)
+            self._interval = self._average(self._interval, interval)
+        self._last_dispatch = now
+
+    def _adapt(self):
+        # keep enough requests to dispatch while next batch is fetching
+        if not self._interval or self._latency is None:
+            return
+        ahead = self._latency / max(self._interval, 1e-6)
+        self._low_water = int(min(max(self._min_cache_size, 2 * ahead),
+                                  self._max_cached // 2))
+        self._cache_size = int(min(max(self._min_cache_size, 4 * ahead),
+                                   self._max_cache_size))
+
+    def _refill(self, force=False):
+        # start a background refill if cache is below low water mark,
+        # return: True if a refill is running
+        if self._refilling is not None:
             return True
-        logger.debug('task<{}> is not allowed'.format(request.url))
-        return False
+        if not self._should_fill():
+            return False
+        if not force and self._cached >= self._low_water:
+            return False
+        count = min(self._cache_size, self._max_cached - self._cached)
+        self._refilling = self._loop.create_task(self._fill(count))
+        self._refilling.add_done_callback(self._fill_done)
+        return True
+
+    async def _fill(self, count):
+        start = time.monotonic()
+        tasks = await self.fetchdiskq.get(count)
+        self._latency = self._average(
+                self._latency, time.monotonic() - start)
+        if self._lease_timeout:
+            deadline = start + self._lease_timeout
+            for task in tasks:
+                if task.lease is not None:
+                    self._deadlines[task.lease] = deadline
+                    self._expiring.discard(task.lease)
+        self._distribute(tasks)
+        self._adapt()
 
-    def next_nowait(self):
-        if not self._caches:
-            tasks = self.fetchdiskq.get_nowait(self._cache_size)
-            self._caches.extend(tasks)
-        return self._caches.popleft()
+    def _fill_done(self, refilling):
+        self._refilling = None
+        if not refilling.cancelled() and refilling.exception():
+            logger.error('refill failed, {}'.format(refilling.exception()))
 
     async def next(self, timeout=None):
         if timeout:
             assert timeout > 0
-        if not self._caches:
-            tasks = await self._get(self._cache_size, timeout=timeout)
-            self._caches.extend(tasks)
-        return self._caches.popleft()
+            return await asyncio.wait_for(self._next(), timeout)
+        return await self._next()
 
-    async def _get(self, count=10, timeout=None):
-        if timeout:
-            coroutin = self.fetchdiskq.get(count)
-            tasks = await asyncio.wait_for(coroutin, timeout)
-        else:
-            tasks = await self.fetchdiskq.get(count)
-        return tasks
+    async def _next(self):
+        while True:
+            task = self._pop_ready()
+            if task is not None:
+                self._dispatched(time.monotonic())
+                self._refill()
+                return task
+            now = time.monotonic()
+            wait = self._ready[0][0] - now if self._ready else None
+            # no host is ready, look ahead for requests of other hosts
+            if self._refill(force=True):
+                await asyncio.wait([self._refilling], timeout=wait)
+            elif self._cached >= self._max_cached:
+                # memory cache is full, wait for the earliest host
+                await asyncio.sleep(wait)
+            else:
+                await self.fetchdiskq.wait(wait)
 
     def is_empty(self):
-        return (not self._caches) and self.fetchdiskq.empty()
+        return (self._cached <= 0 and self.fetchdiskq.empty()
+                and not self._expiring)
+
+    def _drain(self):
+        for slot in self._slots.values():
+            while slot.requests:
+                task = slot.requests.popleft()
+                task.filter_ignore = True
+                yield task
+        self._ready.clear()
+        self._deadlines.clear()
+        self._cached = 0
 
     def close(self):
+        # put cached requests back to queue, they have been removed from it
         self._urlfilter.close()
-        self.fetchdiskq.close()
+        self.fetchdiskq.close(list(self._drain()))
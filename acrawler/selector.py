@@ -0,0 +1,174 @@
+'''selectors of response
+
+page is parsed into a tree once, queries are compiled once and shared
+by all pages, xpath results are wrapped only when they are asked for
+'''
+
+import re
+import functools
+import threading
+import urllib.parse as uparse
+
+import lxml.etree
+import lxml.html
+
+from cssselect import HTMLTranslator
+
+
+_local = threading.local()     # lxml parser must not be shared by threads
+_translator = HTMLTranslator()
+# schemes which never lead to a page
+_ignored_schemes = ('javascript:', 'mailto:', 'tel:', 'data:')
+# lxml does not skip bom of them, decoded text is parsed instead
+_bom_codecs = ('utf-8-sig', 'utf-16', 'utf-32')
+
+
+def html_parser(encoding=None):
+    # parsers are reused, creating one costs more than small page
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        parser = parsers[encoding] = lxml.html.HTMLParser(
+                encoding=encoding, remove_comments=True)
+    return parser
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_xpath(query):
+    return lxml.etree.XPath(query)
+
+
+@functools.lru_cache(maxsize=1024)
+def css_to_xpath(query):
+    return _translator.css_to_xpath(query)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_re(regex):
+    return re.compile(regex)
+
+
+def extract_re(regex, text):
+    # return: all matches, groups of one match are flattened
+    result = []
+    for m in compile_re(regex).finditer(text):
+        groups = m.groups()
+        if not groups:
+            result.append(m.group())
+        else:
+            result.extend(g for g in groups if g is not None)
+    return result
+
+
+def parse_html(raw, encoding=None, base_url=None):
+    # return: root of document, an empty html element if page is empty
+    try:
+        root = lxml.etree.fromstring(
+                raw, parser=html_parser(encoding), base_url=base_url)
+    except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError,
+            ValueError):
+        root = None
+    return lxml.html.Element('html') if root is None else root
+
+
+class SelectorList(list):
+    def xpath(self, query, **variables):
+        return SelectorList(r for s in self for r in s.xpath(
+                query, **variables))
+
+    def css(self, query):
+        return self.xpath(css_to_xpath(query))
+
+    def re(self, regex):
+        return [r for s in self for r in s.re(regex)]
+
+    def get(self, default=None):
+        return self[0].get() if self else default
+
+    def getall(self):
+        return [s.get() for s in self]
+
+    # aliases in scrapy
+    extract_first = get
+    extract = getall
+
+
+class Selector:
+    __slots__ = ['root']
+
+    def __init__(self, root):
+        self.root = root    # element of tree, or string of xpath result
+
+    @classmethod
+    def from_response(cls, response):
+        # known charset is passed to lxml, page is not decoded twice
+        encoding = response.encoding
+        if encoding and not encoding.startswith(_bom_codecs):
+            try:
+                root = parse_html(response.raw, encoding, response.url)
+            except LookupError:     # charset unknown to lxml
+                pass
+            else:
+                return cls(root)
+        raw = response.text.encode('utf-8')
+        return cls(parse_html(raw, 'utf-8', response.url))
+
+    def xpath(self, query, **variables):
+        if isinstance(self.root, str):
+            return SelectorList()
+        result = compile_xpath(query)(self.root, **variables)
+        if not isinstance(result, list):
+            result = [result]   # number, boolean or string
+        return SelectorList(
+                Selector(r if lxml.etree.iselement(r) else str(r))
+                for r in result)
+
+    def css(self, query):
+        return self.xpath(css_to_xpath(query))
+
+    def re(self, regex):
+        return extract_re(regex, self.text)
+
+    @property
+    def text(self):
+        if isinstance(self.root, str):
+            return self.root
+        return self.root.text_content()
+
+    def get(self):
+        if isinstance(self.root, str):
+            return self.root
+        return lxml.html.tostring(self.root, encoding='unicode',
+                                  with_tail=False)
+
+    extract = get
+
+    def __str__(self):
+        return self.get()
+
+    def __repr__(self):
+        return 'Selector<{}>'.format(self.get()[:40])
+
+
+def extract_links(root, base_url, query='//a/@href'):
+    '''return: absolute urls of links in document, order is kept and
+    duplicates are removed, fragments are dropped.
+    param root: root of the whole parsed tree, the page is not streamed,
+    results of query are used as they are, no Selector is created
+    '''
+    base = root.xpath('string(//base/@href)').strip()
+    base = uparse.urljoin(base_url, base) if base else base_url
+    join = functools.partial(uparse.urljoin, base)
+    urls, seen = [], set()
+    for href in compile_xpath(query)(root):
+        href = str(href).strip()
+        if not href or href.startswith('#') \
+                or href.lower().startswith(_ignored_schemes):
+            continue
+        url = uparse.urldefrag(join(href))[0]
+        if url not in seen:
+            seen.add(url)
+            urls.append(url)
+    return urls
@@ -0,0 +1,24 @@
+'''http session shared by all spiders of an engine
+
+connections and TLS sessions are reused across spiders, the connector is
+tuned by engine settings
+'''
+
+import aiohttp
+
+
+def make_connector(settings, resolver=None):
+    return aiohttp.TCPConnector(
+            limit=settings.get('limit', 100),
+            limit_per_host=settings.get('limit_per_host', 0),
+            keepalive_timeout=settings.get('keepalive_timeout', 30),
+            # a caching resolver replaces the cache of connector
+            use_dns_cache=resolver is None,
+            ttl_dns_cache=settings.get('dns_cache_ttl', 300),
+            resolver=resolver)
+
+
+def make_session(settings, headers=None, resolver=None):
+    # session must be made in a coroutine, it is bound to running loop
+    connector = make_connector(settings, resolver=resolver)
+    return aiohttp.ClientSession(connector=connector, headers=headers)
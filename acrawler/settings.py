@@ -7,6 +7,11 @@ DEFAULT_CONFIG = {
         'SchedulerClass': 'acrawler.scheduler.Scheduler',
         'FilterClass': 'acrawler.filterlib.memfilter.MemFilter',
         'QueueClass': 'acrawler.queuelib.sqlitequeue.PrioritySQLiteQueue',
+        # 可选的QueueClass:
+        #   acrawler.queuelib.sqlitequeue.PrioritySQLiteQueue     每个优先级一个数据库
+        #   acrawler.queuelib.sqlitequeue.WALPrioritySQLiteQueue  单个WAL模式数据库, 支持lease
+        #   acrawler.queuelib.spillqueue.SpillPriorityQueue       内存优先, 超出部分批量写入磁盘
+        #   acrawler.queuelib.logqueue.LogPriorityQueue           只追加的mmap日志文件
         # 以下是各模块设置
         'spider': {
             'headers': {
@@ -15,20 +20,68 @@ DEFAULT_CONFIG = {
                     ' Gecko/20100101 Firefox/43.0'),
                 },
             'save_cookie': False,
+            'concurrency': 1,           # 每个spider同时处理的请求数
+            'max_body_size': None,      # 响应体最大字节数, 超出则丢弃, None为不限制
+            'content_types': [],        # 需要的内容类型前缀, 如'text/', 空列表为不限制
+            'chunk_size': 65536,        # 每次读取响应体的字节数
             'debug': False,
             },
         'engine': {
-            'threads': 1
+            'threads': 1,
+            'processes': 1,             # 按host分片运行的engine进程数
+            'parse_workers': None,      # 解析进程数, 默认为cpu核数
+            'limit': 100,               # 最大连接数
+            'limit_per_host': 8,        # 每个host最大连接数, 0为不限制
+            'keepalive_timeout': 30,    # 空闲连接保持时间(秒)
+            'dns_cache_ttl': 300,       # DNS缓存时间(秒)
+            'dns_negative_ttl': 30,     # DNS查询失败的缓存时间(秒)
+            'dns_cache_size': 10000,    # 最多缓存的域名数
+            'dns_prefetch': True,       # 预先解析即将抓取请求的域名
+            'dns_prefetch_limit': 100,  # 同时预解析的最大域名数
             },
         'scheduler': {
+            'host_delay': 0,            # 同一host两次请求的最小间隔(秒)
+            'host_rate': None,          # 每个host每秒最多请求数, 默认不限制
+            'host_burst': 1,            # 每个host令牌桶容量
+            'max_cached': 1000,         # 等待host时最多缓存的请求数
+            'prefetch_min': 10,         # 每次从队列预取的最少请求数
+            'prefetch_max': 500,        # 每次从队列预取的最多请求数
             'queue':{
-                'sqlite_path': './task'
+                'sqlite_path': './task',
+                'codec': 'binary',      # 请求序列化方式: binary, pickle
+                'commit_count': 1000,   # 累计多少次写入后提交
+                'commit_interval': 1,   # 距上次提交多少秒后提交
+                'lease_timeout': None,  # 取出的任务完成前保留在队列中的秒数, None 为不保留
+                'spill_path': './task',     # SpillPriorityQueue 溢出文件目录
+                'memory_size': 100000,      # SpillPriorityQueue 内存中最多保留的请求数
+                'spill_batch': 1000,        # SpillPriorityQueue 每批写入磁盘的请求数
+                'spill_compress': True,     # SpillPriorityQueue 是否压缩溢出的批次
+                'log_path': './task',       # LogPriorityQueue 日志文件目录
+                'segment_size': 67108864,   # LogPriorityQueue 每个日志文件的字节数
             },
             'filter': {
                 'hostonly': True,
                 'maxredirect': None,        # 默认不设置最大跳转数
                 'maxdeep': None,            # 默认不设置最大爬取深度
-                'db_path': './filter'
+                'allow_domains': [],        # 允许的域名, 包括其子域名
+                'deny_domains': [],         # 禁止的域名, 更具体的域名规则优先
+                'allow_patterns': [],       # url须匹配其中一个正则
+                'deny_patterns': [],        # url匹配其中任一正则则丢弃
+                'db_path': './filter',
+                'canonical_cache': 100000,  # 缓存规范化url的数量
+                'fingerprint_bits': 64,     # MemFilter 指纹位数: 32, 64
+                'snapshot_count': 1000000,  # MemFilter 新增多少指纹后保存快照
+                'snapshot_interval': 600,   # MemFilter 距上次快照多少秒后保存
+                'bloom_capacity': 10000000,     # BlumeFilter 预计url数量
+                'bloom_error_rate': 0.001,      # BlumeFilter 误判率
+                'checkpoint_interval': 60,      # BlumeFilter 刷新到磁盘的间隔(秒)
+                'write_buffer': 10000,      # MixedFilter 缓冲多少指纹后写入数据库
+                'flush_interval': 5,        # MixedFilter 缓冲写入数据库的间隔(秒)
+                'read_cache': 100000,       # MixedFilter 缓存已确认的指纹数量
+                'ttl': 86400,               # TTLFilter url多少秒后可再次爬取
+                'ttl_rules': [],            # TTLFilter [[正则, 秒数], ...] 首个匹配的规则生效
+                'ttl_bucket': 3600,         # TTLFilter 每个指纹桶的时间跨度(秒)
+                'ttl_save_interval': 600,   # TTLFilter 距上次保存多少秒后保存当前指纹桶
                 }
             }
         }
@@ -1,27 +1,64 @@
-import aiohttp
+import asyncio
+
 from .model import Response
-from ._spider import BaseSpider
+from ._spider import BaseSpider, in_process
 # from ._spider import logger
 
 
 class Spider(BaseSpider):
     def initialize(self):
-        self._closed = False
-        self._session = aiohttp.ClientSession(loop=self._loop)
+        # session is owned by engine, connections are shared by spiders
+        self._session = self._engine.session()
+
+    def fetch_option(self, request, name):
+        # option of request overwrite the one in settings
+        return request.get_option(name, self._settings.get(name))
+
+    @staticmethod
+    def content_type_ok(content_type, allowed):
+        # param allowed: prefixes of wanted content types, empty for all
+        if not allowed:
+            return True
+        content_type = (content_type or '').lower()
+        return any(content_type.startswith(t) for t in allowed)
 
     async def fetch(self, request, **kwargs):
+        '''body is read chunk by chunk, it is dropped once it is larger
+        than max_body_size, unwanted content type is dropped before body
+        is read. if request has a stream handler, chunks are passed to it
+        instead of being buffered
+        '''
+        max_size = self.fetch_option(request, 'max_body_size')
+        content_types = self.fetch_option(request, 'content_types')
+        stream = request.get_option('stream')
+        handler = getattr(self, stream) if stream else None
         async with self._session.get(request.url, **kwargs) as response:
-            text = await response.text()
+            if not self.content_type_ok(response.content_type,
+                                        content_types):
+                self.log.warning('<{}> content type {} is not wanted'
+                                 .format(request.url, response.content_type))
+                return None
+            if max_size and (response.content_length or 0) > max_size:
+                self.log.warning('<{}> body is larger than {} bytes'
+                                 .format(request.url, max_size))
+                return None
+            chunks, size = [], 0
+            chunk_size = self._settings.get('chunk_size') or 65536
+            async for chunk in response.content.iter_chunked(chunk_size):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    self.log.warning('<{}> body is larger than {} bytes'
+                                     .format(request.url, max_size))
+                    return None
+                if handler is None:
+                    chunks.append(chunk)
+                    continue
+                result = handler(request, chunk)
+                if asyncio.iscoroutine(result):
+                    await result
             status = response.status
-        r = Response(text, status)
-        r.request = request
-        return r
-
-    def close(self):
-        self._closed = True
-        if self._session:
-            self._loop.create_task(self._session.close())
-
-    def __del__(self):
-        if not self._closed:
-            self.close()
+            headers = response.headers
+            charset = response.charset
+        # body is decoded by response when its text is used
+        return Response(b''.join(chunks), request, status=status,
+                        headers=headers, encoding=charset)
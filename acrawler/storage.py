@@ -0,0 +1,283 @@
+'''run queue and filter backends off the event loop
+
+every blocking backend owns a dedicated I/O thread, calls are executed in
+order, and the backend is committed once for each batch of calls, and
+every idle seconds while no call comes
+'''
+
+import queue
+import asyncio
+import logging
+import functools
+import threading
+
+from collections import deque
+from concurrent.futures import Future
+
+from .queuelib.base import QueueEmpty
+
+
+logger = logging.getLogger('Scheduler')
+
+
+class IOWorker:
+    def __init__(self, name, threaded=True, idle=1):
+        self._name = name
+        self._threaded = threaded
+        self._idle = idle
+        self._jobs = queue.Queue()
+        self.commit = None
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(
+                    target=self._work, name=name, daemon=True)
+            self._thread.start()
+
+    def call(self, func, *args):
+        # return: a concurrent.futures.Future of the call
+        future = Future()
+        if not self._threaded:
+            # every call is a batch of its own
+            self._run(func, args, future)
+            self._do_commit()
+        else:
+            self._jobs.put((func, args, future))
+        return future
+
+    @staticmethod
+    def _run(func, args, future):
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _do_commit(self):
+        if self.commit is None:
+            return
+        try:
+            self.commit()
+        except Exception as e:
+            logger.error('{} commit failed, {}'.format(self._name, e))
+
+    def _work(self):
+        while True:
+            try:
+                jobs = [self._jobs.get(timeout=self._idle)]
+            except queue.Empty:
+                # backend commits what is due by its own interval
+                self._do_commit()
+                continue
+            while True:
+                try:
+                    jobs.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            # run jobs first, then commit them together and reply
+            done = []
+            for func, args, future in jobs:
+                if func is None:    # closing, args is the last call
+                    self._do_commit()
+                    self._reply(done)
+                    self._run(args[0], (), future)
+                    return
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    done.append((future, func(*args), None))
+                except BaseException as e:
+                    done.append((future, None, e))
+            self._do_commit()
+            self._reply(done)
+
+    @staticmethod
+    def _reply(done):
+        for future, result, exc in done:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def close(self, func):
+        # commit pending calls, then run func as the last call, blocking
+        if not self._threaded:
+            return self.call(func).result()
+        future = Future()
+        self._jobs.put((None, (func,), future))
+        self._thread.join()
+        return future.result()
+
+
+async def wait_future(future, loop=None):
+    return await asyncio.wrap_future(future, loop=loop)
+
+
+class AsyncQueue:
+    '''awaitable wrapper of a queuelib backend, the size of queue is
+    tracked in memory, so checking emptiness never touch the backend
+    '''
+
+    def __init__(self, QueueClass, settings, loop=None):
+        self._loop = asyncio.get_event_loop() if not loop else loop
+        self._worker = IOWorker('Queue', QueueClass.blocking,
+                                settings.get('commit_interval') or 1)
+        create = functools.partial(QueueClass, settings, loop=self._loop)
+        self._queue = self._worker.call(create).result()
+        self._worker.commit = self._queue.commit
+        self._size = self._worker.call(self._queue.qsize).result()
+        # size counted in I/O thread, calls are counted in their order
+        self._stored = self._size
+        self._returned = deque()    # results of cancelled get
+        self._getters = deque()
+
+    def _put(self, items):
+        putted = len(items) if self._queue._put(items) else 0
+        self._stored += putted
+        return putted
+
+    async def put(self, items):
+        items = list(items)
+        if not items:
+            return 0
+        putted = await wait_future(
+                self._worker.call(self._put, items), self._loop)
+        if putted:
+            self._size += putted
+            self._wakeup_next()
+        return putted
+
+    def _get(self, count):
+        # return: items, the count which was stored but not found, such
+        # as items failed to decode, and the I/O to wait for if any
+        try:
+            items = self._queue._get(count)
+        except QueueEmpty:
+            items = []
+        if items:
+            self._stored -= len(items)
+            return items, 0, None
+        pending = self._queue._pending()
+        if pending is not None:
+            return items, 0, pending
+        lost, self._stored = self._stored, 0
+        return items, lost, None
+
+    def _restore(self, future):
+        if future.cancelled() or future.exception():
+            return
+        items, lost, _ = future.result()
+        self._size -= lost
+        self._returned.extend(items)
+
+    async def get(self, count=1):
+        # return: at most count items, may be empty
+        assert count > 0
+        if self._returned:
+            n = min(count, len(self._returned))
+            items = [self._returned.popleft() for _ in range(n)]
+            self._size -= n
+            return items
+        while True:
+            future = asyncio.wrap_future(
+                    self._worker.call(self._get, count), loop=self._loop)
+            try:
+                items, lost, pending = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # items was removed from backend, keep them for next get
+                future.add_done_callback(self._restore)
+                raise
+            # only deltas are applied, puts done meanwhile are not lost
+            self._size -= len(items) + lost
+            if items or pending is None:
+                return items
+            await asyncio.wrap_future(pending, loop=self._loop)
+
+    async def ack(self, leases):
+        # delete leased items which were done
+        await wait_future(
+                self._worker.call(self._queue._ack, list(leases)),
+                self._loop)
+
+    async def renew(self, leases):
+        await wait_future(
+                self._worker.call(self._queue._renew, list(leases)),
+                self._loop)
+
+    def _expire(self):
+        expired = self._queue._expire()
+        self._stored += len(expired)
+        return expired
+
+    async def expire(self):
+        # items whose lease is timeout become available again
+        # return: leases of them
+        expired = await wait_future(
+                self._worker.call(self._expire), self._loop)
+        if expired:
+            self._size += len(expired)
+            self._wakeup_next()
+        return expired
+
+    async def wait(self, timeout=None):
+        # wait until queue is not empty or timeout, return empty()
+        if self.empty():
+            getter = self._loop.create_future()
+            self._getters.append(getter)
+            try:
+                await asyncio.wait_for(getter, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.empty()
+
+    def _wakeup_next(self):
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                return
+
+    def empty(self):
+        return self._size <= 0
+
+    def qsize(self):
+        return self._size
+
+    def close(self, remains=None):
+        # put back remains and close backend, blocking. leased items are
+        # still in backend, they are delivered again on resume
+        items = list(remains or ()) + list(self._returned)
+        items = [i for i in items if getattr(i, 'lease', None) is None]
+
+        def close():
+            if items:
+                self._queue._put(items)
+            self._queue.commit()
+            self._queue.close()
+        self._worker.close(close)
+
+
+class AsyncFilter:
+    '''awaitable wrapper of a filterlib backend'''
+
+    def __init__(self, FilterClass, settings, loop=None):
+        self._loop = asyncio.get_event_loop() if not loop else loop
+        self._worker = IOWorker('Filter', FilterClass.blocking)
+        self._filter = self._worker.call(FilterClass, settings).result()
+        self._worker.commit = self._filter.commit
+
+    def _allowed_many(self, requests):
+        checked = [r for r in requests if not r.filter_ignore]
+        allowed = {id(r) for r in self._filter.allowed_many(checked)}
+        return [r for r in requests if r.filter_ignore or id(r) in allowed]
+
+    async def allowed(self, request):
+        return bool(await self.allowed_many([request]))
+
+    async def allowed_many(self, requests):
+        # return: requests which are allowed, order is kept
+        return await wait_future(
+                self._worker.call(self._allowed_many, requests), self._loop)
+
+    def close(self):
+        self._worker.close(self._filter.close)
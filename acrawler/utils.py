@@ -1,3 +1,5 @@
+import re
+import codecs
 import random
 
 
@@ -175,18 +177,67 @@ def singleton(cls):
     return inner
 
 
-def decoder(raw):
-    codecs = ['utf-8', 'gbk', 'gb18030']
-    last_e = None
-    for codec in codecs:
+# charset is declared in the head of a page, only that part is searched
+_sniff_size = 4096
+_meta_charset = re.compile(
+        rb'''<meta[^>]+?charset\s*=\s*["']?\s*([-\w.:]+)''', re.I)
+# utf-32 boms start with utf-16 ones, check them first
+_boms = [(codecs.BOM_UTF8, 'utf-8-sig'),
+         (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+         (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+# labels are decoded by their superset, pages often break their charset
+_supersets = {'ascii': 'utf-8', 'gb2312': 'gb18030', 'gbk': 'gb18030'}
+_fallbacks = ['utf-8', 'gb18030']
+
+
+def normalize_charset(charset):
+    # return: python codec name of charset, None if it is unknown
+    if isinstance(charset, bytes):
+        charset = charset.decode('ascii', 'ignore')
+    try:
+        name = codecs.lookup(charset.strip()).name
+    except (LookupError, ValueError):
+        return None
+    return _supersets.get(name, name)
+
+
+def detect_charset(raw, charset=None):
+    '''return: codec of raw, charset of header is trusted first, then
+    meta tag in the head of page, then bom. None if nothing declared
+    '''
+    if charset:
+        charset = normalize_charset(charset)
+        if charset:
+            return charset
+    m = _meta_charset.search(raw, 0, _sniff_size)
+    if m:
+        charset = normalize_charset(m.group(1))
+        if charset:
+            return charset
+    for bom, codec in _boms:
+        if raw.startswith(bom):
+            return codec
+    return None
+
+
+def decoder(raw, charset=None):
+    '''decode body of page, declared charset is decoded once, codecs
+    are tried in turn only when nothing is declared or declared one fails
+    '''
+    charset = detect_charset(raw, charset)
+    if charset is not None:
+        try:
+            return raw.decode(charset)
+        except UnicodeDecodeError:
+            pass    # wrong declaration, guess it as usual
+    for codec in _fallbacks:
+        if codec == charset:
+            continue
         try:
-            content = raw.decode(codec)
-        except UnicodeDecodeError as e:
-            last_e = e
+            return raw.decode(codec)
+        except UnicodeDecodeError:
             continue
-        else:
-            return content
-    raise last_e
+    return raw.decode(charset or _fallbacks[0], 'replace')
 
 
 class UserAgent: